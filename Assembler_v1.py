@@ -2,7 +2,6 @@
 Hack Assembler in Python
 by: Marlen
 """
-import pdb
 import sys
 import os
 import re
@@ -0,0 +1,78 @@
+"""Assembling in memory, for programs that embed the assembler.
+
+from assembler.api import assemble
+words = assemble("@2\nD=A\n@3\nD=D+A\n")  # array('H')
+
+The source is a str, UTF-8 bytes or an iterable of lines. Nothing is read
+from or written to files, and a bad command raises an InvalidCommandError
+with its line number.
+
+'assemble()' can be called from many threads at once. The symbol table and
+the ROM are local to every call anyway, and the parser caches, which the
+parsers of the command line share, belong to an Assembler here. Every
+thread gets an Assembler of its own, so threads never touch each other's
+caches and don't wait on each other either.
+"""
+import threading
+
+from assembler.parser import InvalidCommandError, SourceParser  # InvalidCommandError for callers to catch
+from assembler.service import ENGINES, SYM_ENGINES, engine as get_engine
+
+_local = threading.local()
+
+
+def source_text(source):
+    """Returns source, a str, UTF-8 bytes or an iterable of lines, as a str.
+
+    Lines of an iterable are one line each, with or without their line
+    endings.
+    """
+    if isinstance(source, str):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source).decode("utf-8")
+    return "".join(line if line.endswith("\n") else line + "\n" for line in source)
+
+
+class Assembler:
+    """Assembles sources in memory, with parser caches of its own.
+
+    One Assembler can be shared by threads, its calls then take turns on a
+    lock. Separate Assemblers run concurrently.
+    """
+
+    def __init__(self, cache_size=2048):
+        self.parser = SourceParser.with_caches(cache_size)
+        self.lock = threading.Lock()
+
+    def assemble(self, source, engine="two-pass", sym_table=None):
+        """Assemble source with engine, a key of ENGINES.
+
+        Pass an empty sym_table to get the symbols back, which needs an
+        engine of SYM_ENGINES.
+
+        :rtype: array('H')
+        """
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine {!r}.".format(engine))
+        options = {}
+        if sym_table is not None:
+            if engine not in SYM_ENGINES:
+                raise ValueError("The {} engine can't return its symbol table.".format(engine))
+            options["sym_table"] = sym_table
+        text = source_text(source)
+        with self.lock:
+            return get_engine(engine)(text, self.parser, **options)
+
+
+def assemble(source, engine="two-pass", sym_table=None):
+    """Assemble source with the Assembler of the calling thread.
+
+    See 'Assembler.assemble()'.
+
+    :rtype: array('H')
+    """
+    assembler = getattr(_local, "assembler", None)
+    if assembler is None:
+        assembler = _local.assembler = Assembler()
+    return assembler.assemble(source, engine, sym_table)
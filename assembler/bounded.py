@@ -0,0 +1,398 @@
+"""Assembly in bounded memory, for inputs bigger than RAM.
+
+'two_pass()' keeps every label in a dict and the whole ROM in an array, so
+its memory grows with the input. Here the first pass writes the labels to
+disk instead:
+
+- a label index: the labels sorted by name in a records file, "name
+  address\\n" each, plus an array of the record offsets. Both are memory
+  mapped and a label is found by binary search. The labels are sorted in
+  runs of bounded size that are merged afterwards, like an external sort.
+- a line index: the byte offset and line number of every LINE_STEP-th
+  instruction, to map a ROM address back to its source line by scanning
+  at most LINE_STEP instructions, see 'BoundedAssembler.source_line()'.
+
+The second pass streams the words to the writer, looking labels up through
+a small LRU cache in front of the index. What stays resident is that cache,
+the bounded Parser caches, one run of labels while sorting and the
+variables, which the 16 bit address space bounds anyway. The source is
+memory mapped, and like with MmapParser a lone carriage return doesn't end
+a line.
+
+with open(out_file, "wb") as out_f:
+    assemble(file, out_f, WRITERS["hack"], max_memory=64 << 20)
+
+The output is the same as the one of 'two_pass()'. With max_memory the
+anonymous resident memory, which leaves out the mapped files, is checked
+every CHECK_LINES lines and a MemoryBudgetError is raised once it is
+exceeded. The temporary files go to tmp_dir, so the input size is bounded
+by the disk there.
+"""
+import heapq
+import mmap
+import os
+import sys
+import tempfile
+from array import array
+from operator import itemgetter
+
+from assembler import code, stats
+from assembler.code import BUILTIN_WORDS
+from assembler.parser import Instruction, InvalidCommandError, Parser
+from assembler.passes import constant_error, encode_c
+from assembler.stream import blocks
+from assembler.utils import ManualCache
+
+LINE_STEP = 1024  # instructions between line index entries
+CHECK_LINES = 1 << 16  # lines between memory checks
+OFFSETS_BLOCK = 1024  # label offsets buffered before writing them
+
+
+class MemoryBudgetError(MemoryError):
+    """The assembler needs more memory than max_memory allows."""
+
+
+def resident_memory():
+    """Returns the anonymous resident memory of this process in bytes.
+
+    Mapped files don't count, their pages can be dropped and read again.
+    Where there is no /proc the peak resident size is used instead.
+
+    :returns None when it can't be measured
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            fields = f.read().split()
+        return (int(fields[1]) - int(fields[2])) * mmap.PAGESIZE
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _map(file):
+    """Memory map file for reading, None when it is empty."""
+    with open(file, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _last_definitions(labels):
+    """Yields the last of every run of labels with the same name."""
+    previous = None
+    for label in labels:
+        if previous is not None and label[0] != previous[0]:
+            yield previous
+        previous = label
+    if previous is not None:
+        yield previous
+
+
+class LabelIndex:
+    """The sorted labels written by the first pass, see the module docstring."""
+
+    def __init__(self, records_file, offsets_file):
+        self.records = _map(records_file)
+        self.offsets_map = _map(offsets_file)
+        if self.offsets_map is None:
+            self.offsets = ()
+        else:
+            self.offsets = memoryview(self.offsets_map).cast("Q")
+
+    @staticmethod
+    def write(labels, records_file, offsets_file):
+        """Write an index of labels, (name as bytes, address) sorted by name.
+
+        Of a label defined more than once the last definition counts, as
+        in 'SymbolTable.add_entry()'.
+
+        :returns the number of labels written
+        """
+        offsets = array("Q")
+        offset = 0
+        count = 0
+        with open(records_file, "wb") as records, open(offsets_file, "wb") as offsets_f:
+            for name, address in _last_definitions(labels):
+                record = b"%s %d\n" % (name, address)
+                records.write(record)
+                offsets.append(offset)
+                offset += len(record)
+                count += 1
+                if len(offsets) >= OFFSETS_BLOCK:
+                    offsets.tofile(offsets_f)
+                    del offsets[:]
+            offsets.tofile(offsets_f)
+        return count
+
+    def get(self, symbol):
+        """Returns the address of label symbol, None if it isn't one.
+
+        :rtype: int
+        """
+        key = symbol.encode("utf-8")
+        records = self.records
+        offsets = self.offsets
+        low, high = 0, len(offsets)
+        while low < high:
+            middle = (low + high) // 2
+            start = offsets[middle]
+            end = records.find(b" ", start)
+            name = records[start:end]
+            if name < key:
+                low = middle + 1
+            elif name > key:
+                high = middle
+            else:
+                return int(records[end + 1:records.find(b"\n", end)])
+        return None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        if self.offsets_map is not None:
+            self.offsets.release()  # the map can't be closed while viewed
+            self.offsets_map.close()
+        if self.records is not None:
+            self.records.close()
+
+
+class BoundedAssembler:
+    """Assembles file in bounded memory, see the module docstring.
+
+    with BoundedAssembler(file, max_memory) as ba:
+        ba.write(out_f, writer)
+
+    max_memory in bytes, None not to check. The caches and sort runs are
+    sized from it, and the temporary files live as long as the context.
+    """
+
+    def __init__(self, file, max_memory=None, tmp_dir=None):
+        self.file = file
+        self.max_memory = max_memory
+        self.tmp_dir = tmp_dir
+        if max_memory is None:
+            self.run_size = 1 << 16
+            cache_size = 1 << 12
+        else:
+            self.run_size = max(1024, max_memory // 1024)
+            cache_size = max(256, max_memory // 4096)
+        self.symbol_cache = ManualCache(max_size=cache_size)
+        self.directory = None
+        self.labels = None
+        self.lines = None  # array('Q') of (offset, line number) pairs, memory mapped
+        self.lines_map = None
+        self.size = 0  # of the ROM
+
+    def __enter__(self):
+        self.directory = tempfile.TemporaryDirectory(prefix="assembler-", dir=self.tmp_dir)
+        try:
+            self.scan()
+        except BaseException:
+            self.close()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.labels is not None:
+            self.labels.close()
+            self.labels = None
+        if self.lines_map is not None:
+            self.lines.release()
+            self.lines_map.close()
+            self.lines_map = None
+        if self.directory is not None:
+            self.directory.cleanup()
+            self.directory = None
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def check_memory(self):
+        """Raise a MemoryBudgetError when over max_memory."""
+        if self.max_memory is None:
+            return
+        used = resident_memory()
+        if used is not None and used > self.max_memory:
+            raise MemoryBudgetError("Assembling {} needs more than {} MB of memory, {} MB in use.".format(
+                self.file, self.max_memory >> 20, used >> 20))
+
+    def source(self, offset=0):
+        """Yields (length in bytes, fields or None) of every line of the
+        source from byte offset on, see 'Parser.tokenize()'.
+
+        Lines are read from a memory map and decoded one at a time, and
+        tokenized through the Parser caches like 'Parser.instructions()'.
+        """
+        cache = Parser.fields_cache
+        tokenize = Parser(None).tokenize
+        mm = _map(self.file)
+        if mm is None:
+            return
+        try:
+            mm.seek(offset)
+            for raw in iter(mm.readline, b""):
+                line = raw.decode("utf-8")
+                try:
+                    fields = cache[line]
+                except KeyError:
+                    fields = cache[line] = tokenize(line)
+                yield len(raw), fields
+        finally:
+            mm.close()
+
+    def scan(self):
+        """First pass: write the label and line indexes."""
+        runs = []
+        labels = []
+        line_index = array("Q")
+        address = 0
+        offset = 0
+        line = 0
+        with stats.phase("label_scan"):
+            with open(self.path("lines"), "wb") as lines_f:
+                for size, fields in self.source():
+                    line += 1
+                    if fields is not None:
+                        kind = fields[0]
+                        if kind == "L_COMMAND":
+                            if fields[1] not in BUILTIN_WORDS:  # ignored, see 'SymbolTable.add_entry()'
+                                labels.append((fields[1].encode("utf-8"), address))
+                                if len(labels) >= self.run_size:
+                                    runs.append(self.write_run(labels, len(runs)))
+                                    labels = []
+                        elif kind is None:
+                            raise InvalidCommandError(line)
+                        else:
+                            if address % LINE_STEP == 0:
+                                line_index.append(offset)
+                                line_index.append(line)
+                                if len(line_index) >= 2 * LINE_STEP:
+                                    line_index.tofile(lines_f)
+                                    del line_index[:]
+                            address += 1
+                    offset += size
+                    if line % CHECK_LINES == 0:
+                        self.check_memory()
+                line_index.tofile(lines_f)
+            stats.count("lines_read", line)
+            self.size = address
+
+        with stats.phase("index"):
+            if labels or not runs:
+                runs.append(self.write_run(labels, len(runs)))
+            del labels
+            files = [open(run, "rb") for run in runs]
+            try:
+                merged = heapq.merge(*[self.read_run(f) for f in files], key=itemgetter(0))
+                count = LabelIndex.write(merged, self.path("labels"), self.path("offsets"))
+            finally:
+                for f in files:
+                    f.close()
+            for run in runs:
+                os.remove(run)
+            self.labels = LabelIndex(self.path("labels"), self.path("offsets"))
+            self.lines_map = _map(self.path("lines"))
+            self.lines = memoryview(self.lines_map).cast("Q") if self.lines_map is not None else ()
+        stats.count("labels", count)
+
+    def write_run(self, labels, number):
+        """Sort labels by name into a run file, keeping the order of
+        definition of equal names.
+
+        :returns the file name
+        """
+        labels.sort(key=itemgetter(0))
+        run = self.path("run{}".format(number))
+        with open(run, "wb") as f:
+            f.writelines(b"%s %d\n" % label for label in labels)
+        self.check_memory()
+        return run
+
+    @staticmethod
+    def read_run(f):
+        for record in f:
+            name, address = record.split()
+            yield name, int(address)
+
+    def words(self):
+        """Second pass: yields the words of the ROM."""
+        builtins = BUILTIN_WORDS
+        cache = self.symbol_cache
+        index = self.labels
+        variables = {}
+        next_variable = 16
+        c_words = code.C_FIELD_WORDS
+        line = 0
+        for _, fields in self.source():
+            line += 1
+            if fields is None:
+                continue
+            kind = fields[0]
+            if kind == "A_COMMAND":
+                symbol = fields[1]
+                word = builtins.get(symbol)
+                if word is None:
+                    if symbol.isdecimal():
+                        word = int(symbol)
+                        if word > 0xFFFF:
+                            raise constant_error(line, symbol)
+                    elif symbol in variables:
+                        word = variables[symbol]
+                    else:
+                        try:
+                            word = cache[symbol]
+                        except KeyError:
+                            word = index.get(symbol)
+                            if word is None:
+                                word = variables[symbol] = next_variable
+                                next_variable += 1
+                            else:
+                                cache[symbol] = word
+                yield word
+            elif kind == "C_COMMAND":
+                word = c_words.get(fields[2:])
+                yield word if word is not None else encode_c(Instruction._make(fields + (line,)))
+            if line % CHECK_LINES == 0:
+                self.check_memory()
+        stats.count("variables", len(variables))
+
+    def write(self, out_f, writer, block_size=1024):
+        """Write the ROM to the binary file out_f with writer, one of the WRITERS."""
+        with stats.phase("encode"):
+            writer.stream(out_f, blocks(self.words(), block_size))
+        stats.count("commands", self.size)
+
+    def source_line(self, address):
+        """Returns the source line number of the instruction at ROM address.
+
+        :rtype: int
+        """
+        if not 0 <= address < self.size:
+            raise IndexError("ROM address {} out of range.".format(address))
+        entry = address // LINE_STEP
+        offset, line = self.lines[2 * entry], self.lines[2 * entry + 1]
+        skip = address % LINE_STEP
+        for _, fields in self.source(offset):
+            if fields is not None and fields[0] != "L_COMMAND":
+                if not skip:
+                    return line
+                skip -= 1
+            line += 1
+
+
+def assemble(file, out_f, writer, max_memory=None, tmp_dir=None):
+    """Assemble file into the binary file out_f in bounded memory.
+
+    See 'BoundedAssembler' for max_memory and tmp_dir.
+    """
+    with BoundedAssembler(file, max_memory, tmp_dir) as ba:
+        ba.write(out_f, writer)
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import assembler
+
+
+class BuildCache:
+    """A content addressed, on disk cache of assembled outputs.
+
+    Entries are keyed by a hash of the source bytes, the assembler version,
+    the output format and the engine (the peephole engine gives another
+    ROM), so an unchanged source is never parsed twice. They live in
+    'directory/<2 hex digits>/<key>' and hits refresh the entry's mtime.
+    'evict()' drops the least recently used entries until the cache fits in
+    max_size bytes.
+
+    With link=True outputs are hard-linked from the cache instead of copied.
+    Rewriting such an output in place would change the cached entry too, so
+    callers have to replace linked outputs rather than write into them.
+    """
+    stats_file = "stats.json"
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024, link=False):
+        self.directory = directory
+        self.max_size = max_size
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(source, format, engine="two-pass"):
+        """Returns the cache key of the source bytes in the given format,
+        assembled by engine."""
+        h = hashlib.sha256()
+        h.update("{}\0{}\0{}\0".format(assembler.__version__, format, engine).encode())
+        h.update(source)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key, out_file):
+        """Copy (or link) the entry for key to out_file.
+
+        :returns True on a hit, False on a miss.
+        """
+        entry = self.path(key)
+        try:
+            os.utime(entry)  # mark as recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        if os.path.lexists(out_file):
+            os.remove(out_file)
+        if self.link:
+            try:
+                os.link(entry, out_file)
+            except OSError:  # e.g. another file system
+                shutil.copyfile(entry, out_file)
+        else:
+            shutil.copyfile(entry, out_file)
+        self.hits += 1
+        return True
+
+    def store(self, key, out_file):
+        """Add out_file to the cache under key."""
+        entry = self.path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # Copy to a temporary name first so readers never see a partial entry.
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(entry))
+        os.close(fd)
+        try:
+            shutil.copyfile(out_file, tmp)
+            os.replace(tmp, entry)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def entries(self):
+        """Returns (mtime, size, path) of every entry, oldest first."""
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for sub in os.scandir(self.directory):
+            if sub.is_dir():
+                for entry in os.scandir(sub.path):
+                    st = entry.stat()
+                    found.append((st.st_mtime, st.st_size, entry.path))
+        found.sort()
+        return found
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_size.
+
+        :returns the number of removed entries.
+        """
+        if self.max_size is None:
+            return 0
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # evicted by someone else
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def record(self, hits=None, misses=None):
+        """Add this run's hits and misses to the totals kept in the cache."""
+        totals = self.load_totals()
+        totals["hits"] += self.hits if hits is None else hits
+        totals["misses"] += self.misses if misses is None else misses
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.stats_file), "w") as f:
+            json.dump(totals, f)
+
+    def load_totals(self):
+        try:
+            with open(os.path.join(self.directory, self.stats_file)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {"hits": 0, "misses": 0}
+
+    def stats(self):
+        """Returns a dict describing the cache and its hit counts."""
+        entries = self.entries()
+        totals = self.load_totals()
+        return {
+            "directory": self.directory,
+            "entries": len(entries),
+            "size": sum(size for _, size, _ in entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": totals["hits"],
+            "total_misses": totals["misses"],
+        }
+
+    def report(self, hits=None, misses=None):
+        """Returns a human readable version of 'stats()'."""
+        stats = self.stats()
+        hits = stats["hits"] if hits is None else hits
+        misses = stats["misses"] if misses is None else misses
+        lookups = stats["total_hits"] + stats["total_misses"]
+        ratio = stats["total_hits"] / lookups if lookups else 0.0
+        return ("Build cache: {directory}\n"
+                "  entries: {entries}, size: {size} of {max_size} bytes\n"
+                "  this run: {hits} hits, {misses} misses\n"
+                "  all runs: {total_hits} hits, {total_misses} misses ({ratio:.1%})"
+                ).format(ratio=ratio, **dict(stats, hits=hits, misses=misses))
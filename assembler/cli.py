@@ -0,0 +1,333 @@
+"""The command line interface, 'python -m assembler' or Assembler.py.
+
+Only what every run needs is imported up front. The build cache, streaming,
+the process pool and the profiler are imported when an option asks for
+them, so that short runs start fast. benchmarks/startup.py keeps an eye on
+the import time.
+"""
+import argparse
+import os
+import sys
+
+from assembler import stats
+from assembler.parser import InvalidCommandError, MmapParser, Parser
+from assembler.service import ENGINES, SYM_ENGINES, engine as get_engine
+from assembler.symbol_table import SymbolTable
+from assembler.writers import WRITERS
+
+
+def assemble_file(file, format="hack", engine="two-pass", mmap=False, cache=None, out_file=None, jobs=None,
+                  sym=False, preprocess=False, max_memory=None):
+    """Assemble file and write the output to out_file.
+
+    out_file defaults to file with its extension replaced by the one of the
+    format. engine is a key of ENGINES. cache is an optional BuildCache. On a
+    hit the output comes from the cache and the source isn't parsed at all.
+    sym also writes the symbols next to out_file, which needs an engine of
+    SYM_ENGINES and bypasses the cache. preprocess expands includes and
+    macros first, the cache isn't used then as it only sees file itself.
+    max_memory, in MB, assembles in bounded memory with assembler.bounded
+    instead of the engine.
+
+    :returns the output file name
+    """
+    writer = WRITERS[format]
+    if out_file is None:
+        out_file = os.path.splitext(file)[0] + writer.suffix
+    stats.count("files")
+    if preprocess:
+        cache = None
+    if cache is not None:
+        with stats.phase("build_cache"):
+            with open(file, "rb") as f:
+                key = cache.key(f.read(), format, engine)
+            if not sym and cache.fetch(key, out_file):
+                return out_file
+
+    if os.path.isfile(out_file) and os.stat(out_file).st_nlink > 1:
+        os.remove(out_file)  # don't write through a hard link into the build cache
+    if max_memory is not None:
+        from assembler import bounded
+        try:
+            with open(out_file, "wb") as out_f:
+                bounded.assemble(file, out_f, writer, max_memory << 20)
+        except Exception:
+            os.remove(out_file)  # don't leave half an output behind
+            raise
+    else:
+        parser = MmapParser if mmap else Parser
+        if preprocess:
+            from assembler.preprocessor import PreprocessingParser
+            parser = PreprocessingParser
+        engine_options = {"jobs": jobs} if engine == "parallel" else {}
+        if sym:
+            sym_table = engine_options["sym_table"] = SymbolTable()
+        words = get_engine(engine)(file, parser, **engine_options)
+        stats.count("commands", len(words))
+        with stats.phase("write"):
+            writer.write(out_file, words)
+            if sym:
+                sym_table.write_sym(os.path.splitext(out_file)[0] + ".sym")
+    if cache is not None:
+        with stats.phase("build_cache"):
+            cache.store(key, out_file)
+    return out_file
+
+
+def stream_file(in_file, out_file, format="hack", buffer_size=4096):
+    """Assemble in_file into out_file as a stream, either can be '-'.
+
+    '-' is stdin for in_file and stdout for out_file. Memory stays bounded,
+    see assembler.stream for how forward label references are handled.
+    """
+    from assembler import stream
+    writer = WRITERS[format]
+    in_f = sys.stdin if in_file == "-" else open(in_file)
+    try:
+        out_f = sys.stdout.buffer if out_file == "-" else open(out_file, "wb")
+        try:
+            stream.assemble(in_f, out_f, writer, buffer_size)
+        finally:
+            if out_f is not sys.stdout.buffer:
+                out_f.close()
+    finally:
+        if in_f is not sys.stdin:
+            in_f.close()
+
+
+def expand_inputs(inputs):
+    """Turn command line inputs into a list of .asm files.
+
+    An input can be a file, a directory (searched recursively for .asm
+    files), a glob pattern or '@manifest', a text file listing more inputs
+    one per line. Blank lines and lines starting with '#' are skipped and
+    relative entries are taken relative to the manifest. Duplicates are
+    dropped and the order is kept, so output placement is deterministic.
+    """
+    import glob
+    files = []
+    for item in inputs:
+        if item.startswith("@"):
+            manifest = item[1:]
+            base = os.path.dirname(manifest)
+            with open(manifest) as f:
+                entries = [line.strip() for line in f]
+            entries = [os.path.join(base, e) for e in entries if e and not e.startswith("#")]
+            files.extend(expand_inputs(entries))
+        elif os.path.isdir(item):
+            files.extend(sorted(glob.glob(os.path.join(item, "**", "*.asm"), recursive=True)))
+        elif glob.has_magic(item):
+            files.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            files.append(item)
+    return list(dict.fromkeys(files))
+
+
+def _batch_job(job):
+    """Runs in a worker process.
+
+    :returns (file, out_file, error, cache_hit, stats) with stats the
+             as_dict() of the job's Stats, or None
+    """
+    file, collect_stats, options = job
+    job_stats = stats.enable() if collect_stats else None
+    cache = options.get("cache")
+    hits = cache.hits if cache is not None else 0
+    try:
+        out_file = assemble_file(file, **options)
+        error = None
+    except Exception as ex:
+        out_file = None
+        error = "{}: {}".format(type(ex).__name__, ex)
+    if job_stats is not None:
+        job_stats.stop()
+        job_stats = job_stats.as_dict()
+    return file, out_file, error, cache is not None and cache.hits > hits, job_stats
+
+
+def batch(files, jobs=None, cache_size=None, **options):
+    """Assemble many files in a process pool.
+
+    jobs defaults to the number of cores. The options are passed on to
+    'assemble_file()'. One file failing doesn't stop the others. When stats
+    are enabled the workers' stats are merged into them.
+
+    :returns (file, out_file, error, cache_hit) tuples in the order of
+             files, error is None on success.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = jobs or os.cpu_count() or 1
+    chunksize = max(1, len(files) // (jobs * 4))
+    initializer = Parser.resize_caches if cache_size is not None else None
+    run_stats = stats.current()
+    job_list = [(file, run_stats is not None, options) for file in files]
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer,
+                             initargs=(cache_size,)) as pool:
+        for file, out_file, error, cache_hit, job_stats in pool.map(_batch_job, job_list,
+                                                                    chunksize=chunksize):
+            if job_stats is not None:
+                run_stats.merge(job_stats)
+            results.append((file, out_file, error, cache_hit))
+    return results
+
+
+def make_arg_parser():
+    arg_parser = argparse.ArgumentParser(description="Assemble Hack assembly files.")
+    arg_parser.add_argument("files", nargs="+", metavar="file",
+                            help="an .asm file, a directory, a glob or @manifest, "
+                                 "'-' streams from stdin")
+    arg_parser.add_argument("-o", "--output", metavar="FILE",
+                            help="output file for a single input, '-' streams to stdout")
+    arg_parser.add_argument("--stream-buffer", type=int, default=4096, metavar="N",
+                            help="when streaming, wait at most N instructions for a forward "
+                                 "label reference to resolve (default: %(default)s)")
+    arg_parser.add_argument("--engine", choices=ENGINES, default="two-pass",
+                            help="how to assemble: read the source twice, once and backpatch "
+                                 "forward label references, vectorized with numpy, split "
+                                 "into chunks assembled by several processes, or read once and "
+                                 "optimized before encoding (default: %(default)s)")
+    arg_parser.add_argument("--single-pass", dest="engine", action="store_const", const="single-pass",
+                            help="same as --engine single-pass")
+    arg_parser.add_argument("-O", "--optimize", dest="engine", action="store_const", const="peephole",
+                            help="same as --engine peephole: remove redundant loads, jumps to the "
+                                 "next instruction and dead code, for code that only jumps to labels")
+    arg_parser.add_argument("--sym", action="store_true",
+                            help="also write the labels and variables to a .sym file next to "
+                                 "each output, for debuggers (two-pass, single-pass and peephole engines)")
+    arg_parser.add_argument("-P", "--preprocess", action="store_true",
+                            help="expand %%include and %%macro directives, see assembler.preprocessor")
+    arg_parser.add_argument("--max-memory", type=int, metavar="MB",
+                            help="assemble in bounded memory with on-disk label indexes, failing "
+                                 "when more than MB megabytes stay resident, for inputs bigger than RAM")
+    arg_parser.add_argument("--mmap", action="store_true",
+                            help="memory map the source and tokenize it as bytes")
+    arg_parser.add_argument("--cache-size", type=int, metavar="N",
+                            help="keep at most N entries in each parser cache (default: %d)"
+                                 % Parser.command_type_cache.maxsize)
+    arg_parser.add_argument("--format", choices=WRITERS, default="hack",
+                            help="output format (default: %(default)s)")
+    arg_parser.add_argument("--cache-dir", metavar="DIR",
+                            help="reuse outputs of unchanged sources from a build cache in DIR")
+    arg_parser.add_argument("--cache-max-size", type=int, default=256, metavar="MB",
+                            help="evict old build cache entries above this size (default: %(default)s)")
+    arg_parser.add_argument("--cache-link", action="store_true",
+                            help="hard-link outputs from the build cache instead of copying them")
+    arg_parser.add_argument("--cache-stats", action="store_true",
+                            help="report build cache statistics")
+    arg_parser.add_argument("--watch", action="store_true",
+                            help="keep assembling the inputs again as they change, editing "
+                                 "the last output instead of starting over")
+    arg_parser.add_argument("--watch-interval", type=float, default=0.5, metavar="SECONDS",
+                            help="how often --watch looks for changes (default: %(default)s)")
+    arg_parser.add_argument("-j", "--jobs", type=int, metavar="N",
+                            help="worker processes in batch mode or of --engine parallel "
+                                 "(default: one per core)")
+    arg_parser.add_argument("--stats", action="store_true",
+                            help="print phase timings, counters and cache statistics to stderr")
+    arg_parser.add_argument("--stats-json", metavar="FILE",
+                            help="write the statistics as JSON to FILE ('-' for stdout)")
+    arg_parser.add_argument("--profile", nargs="?", const="assembler.prof", metavar="FILE",
+                            help="run under cProfile, dump the pstats to FILE "
+                                 "(default: %(const)s) and print the top functions to stderr")
+    return arg_parser
+
+
+def run(args, arg_parser):
+    """Do what the parsed command line args ask for.
+
+    :returns the exit status
+    """
+    if args.output is not None and len(args.files) != 1:
+        arg_parser.error("--output needs exactly one input")
+    if args.sym and args.engine not in SYM_ENGINES:
+        arg_parser.error("--sym needs --engine {}".format(" or ".join(SYM_ENGINES)))
+    if args.max_memory is not None and (args.sym or args.preprocess or args.engine != "two-pass"):
+        arg_parser.error("--max-memory can't be used with --sym, --preprocess or another --engine")
+    if args.watch:
+        if "-" in args.files or args.output is not None:
+            arg_parser.error("--watch writes next to each input, from files only")
+        from assembler import incremental
+        return incremental.watch(lambda: expand_inputs(args.files), args.format, args.watch_interval)
+    if "-" in (args.files[0], args.output):
+        if len(args.files) != 1:
+            arg_parser.error("'-' can't be mixed with other inputs")
+        if args.sym or args.preprocess or args.max_memory is not None:
+            arg_parser.error("--sym, --preprocess and --max-memory can't be used when streaming")
+        from assembler import stream
+        try:
+            stream_file(args.files[0], args.output or "-", args.format, args.stream_buffer)
+        except (stream.StreamBufferError, InvalidCommandError) as ex:
+            print(ex, file=sys.stderr)
+            return 1
+        return 0
+
+    cache = None
+    if args.cache_dir is not None:
+        from assembler.build_cache import BuildCache
+        cache = BuildCache(args.cache_dir, args.cache_max_size * 1024 * 1024, args.cache_link)
+    options = dict(format=args.format, engine=args.engine, mmap=args.mmap, cache=cache, sym=args.sym,
+                   preprocess=args.preprocess, max_memory=args.max_memory)
+    single_file = len(args.files) == 1 and os.path.isfile(args.files[0])
+    if single_file:
+        if args.cache_size is not None:
+            Parser.resize_caches(args.cache_size)
+        errors = (InvalidCommandError,)
+        if args.preprocess:
+            from assembler.preprocessor import PreprocessorError
+            errors += (PreprocessorError,)
+        try:
+            assemble_file(args.files[0], out_file=args.output, jobs=args.jobs, **options)
+        except MemoryError as ex:
+            print(ex, file=sys.stderr)
+            return 1
+        except errors as ex:
+            print("{}: {}".format(args.files[0], ex), file=sys.stderr)
+            return 1
+        hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+        failed = 0
+    else:
+        files = expand_inputs(args.files)
+        failed = hits = 0
+        for file, out_file, error, cache_hit in batch(files, args.jobs, args.cache_size, **options):
+            if error is None:
+                hits += cache_hit
+                print("{} -> {}".format(file, out_file))
+            else:
+                failed += 1
+                print("{}: FAILED: {}".format(file, error), file=sys.stderr)
+        misses = len(files) - failed - hits
+        print("{} assembled, {} failed.".format(len(files) - failed, failed))
+
+    if cache is not None:
+        cache.evict()
+        cache.record(hits, misses)
+        if args.cache_stats:
+            print(cache.report(hits, misses))
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    arg_parser = make_arg_parser()
+    args = arg_parser.parse_args(argv)
+    run_stats = stats.enable() if args.stats or args.stats_json else None
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        status = profiler.runcall(run, args, arg_parser)
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+    else:
+        status = run(args, arg_parser)
+
+    if run_stats is not None:
+        run_stats.stop()
+        if args.stats:
+            print(run_stats.report(), file=sys.stderr)
+        if args.stats_json == "-":
+            print(run_stats.to_json())
+        elif args.stats_json:
+            with open(args.stats_json, "w") as f:
+                f.write(run_stats.to_json())
+    return status
@@ -0,0 +1,129 @@
+"""A thin client of the assembler daemon, see assembler.daemon.
+
+e.g.
+python -m assembler.client Prog.asm
+python -m assembler.client - --format raw < Prog.asm > Prog.bin
+
+When no daemon is listening the request is assembled in this process
+instead, with the same code the daemon runs, so the output is the same
+either way. Only that fallback imports the assembler itself.
+
+Tools that assemble many files can keep one connection open:
+with Client() as client:
+    header, output = client.request({"path": os.path.abspath(file)})
+"""
+import argparse
+import os
+import socket
+import sys
+
+from assembler import protocol
+
+
+class Client:
+    """A connection to the daemon, falling back to in-process assembly.
+
+    Connects on first use. fallback=False makes an unreachable daemon
+    raise ConnectionError instead.
+    """
+
+    def __init__(self, socket_path=None, fallback=True):
+        self.socket_path = socket_path or protocol.default_socket_path()
+        self.fallback = fallback
+        self.sock = None
+        self.local = False  # True once fallen back
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def request(self, header, body=b""):
+        """Send one request, see assembler.protocol.
+
+        :returns (response header, response body)
+        """
+        if self.sock is None and not self.local:
+            try:
+                self.connect()
+            except (FileNotFoundError, ConnectionRefusedError):
+                if not self.fallback:
+                    raise ConnectionError("No assembler daemon on {}.".format(self.socket_path))
+                self.local = True
+        if self.local:
+            from assembler import service
+            return service.handle(header, body)
+        self.sock.sendall(protocol.pack(header, body))
+        return protocol.recv(self.sock)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Assemble a Hack assembly file through the daemon.")
+    arg_parser.add_argument("file", nargs="?", help="an .asm file, '-' reads the source from stdin")
+    arg_parser.add_argument("-o", "--output", metavar="FILE",
+                            help="output file, '-' for stdout (default: file with the format's extension)")
+    arg_parser.add_argument("--format", default="hack", help="output format (default: %(default)s)")
+    arg_parser.add_argument("--engine", default="two-pass", help="assembler engine (default: %(default)s)")
+    arg_parser.add_argument("-P", "--preprocess", action="store_true",
+                            help="expand %%include and %%macro directives, the daemon keeps "
+                                 "included files parsed")
+    arg_parser.add_argument("--socket", metavar="PATH", help="daemon socket (default: the per user one)")
+    arg_parser.add_argument("--no-fallback", action="store_true",
+                            help="fail instead of assembling in process when no daemon is running")
+    arg_parser.add_argument("--shutdown", action="store_true", help="stop the daemon instead")
+    args = arg_parser.parse_args(argv)
+    if args.file is None and not args.shutdown:
+        arg_parser.error("a file is required")
+
+    with Client(args.socket, fallback=not (args.no_fallback or args.shutdown)) as client:
+        if args.shutdown:
+            try:
+                client.request({"op": "shutdown"})
+            except ConnectionError as ex:
+                print(ex, file=sys.stderr)
+                return 1
+            return 0
+        request = {"op": "assemble", "format": args.format, "engine": args.engine}
+        body = b""
+        if args.file == "-":
+            if args.preprocess:
+                arg_parser.error("--preprocess needs a file")
+            body = sys.stdin.buffer.read()
+        else:
+            request["path"] = os.path.abspath(args.file)
+            request["preprocess"] = args.preprocess
+        header, output = client.request(request, body)
+
+    if not header["ok"]:
+        error = header["error"]
+        print("{}: {}: {}".format(args.file, error["type"], error["message"]), file=sys.stderr)
+        return 1
+    out_file = args.output
+    if out_file is None:
+        out_file = "-" if args.file == "-" else os.path.splitext(args.file)[0] + header["suffix"]
+    if out_file == "-":
+        sys.stdout.buffer.write(output)
+        sys.stdout.flush()
+    else:
+        with open(out_file, "wb") as out_f:
+            out_f.write(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -51,33 +51,115 @@ JUMP_CODES = {
      "JMP": "111"
 }
 
-BUILTIN_SYMBOLS = {
-    "R0":      "0000000000000000",
-    "R1":      "0000000000000001",
-    "R2":      "0000000000000010",
-    "R3":      "0000000000000011",
-    "R4":      "0000000000000100",
-    "R5":      "0000000000000101",
-    "R6":      "0000000000000110",
-    "R7":      "0000000000000111",
-    "R8":      "0000000000001000",
-    "R9":      "0000000000001001",
-    "R10":     "0000000000001010",
-    "R11":     "0000000000001011",
-    "R12":     "0000000000001100",
-    "R13":     "0000000000001101",
-    "R14":     "0000000000001110",
-    "R15":     "0000000000001111",
-    "SCREEN":  "0100000000000000",  # 0x4000
-    "KBD":     "0110000000000000",  # 0x6000
-    "SP":      "0000000000000000",
-    "LCL":     "0000000000000001",
-    "ARG":     "0000000000000010",
-    "THIS":    "0000000000000011",
-    "THAT":    "0000000000000100",
+# Builtin symbol -> address.
+BUILTIN_WORDS = {
+    "R0":      0,
+    "R1":      1,
+    "R2":      2,
+    "R3":      3,
+    "R4":      4,
+    "R5":      5,
+    "R6":      6,
+    "R7":      7,
+    "R8":      8,
+    "R9":      9,
+    "R10":     10,
+    "R11":     11,
+    "R12":     12,
+    "R13":     13,
+    "R14":     14,
+    "R15":     15,
+    "SCREEN":  0x4000,
+    "KBD":     0x6000,
+    "SP":      0,
+    "LCL":     1,
+    "ARG":     2,
+    "THIS":    3,
+    "THAT":    4
 }
 
 
+def c_text(dest, comp, jump):
+    """Returns the cleaned text of a C-instruction, e.g. "AM=M+1" or "D;JGT".
+
+    A "null" dest or jump is left out the same way it is left out of the
+    source.
+    """
+    text = comp
+    if dest != "null":
+        text = dest + "=" + text
+    if jump != "null":
+        text = text + ";" + jump
+    return text
+
+
+def _build_c_words():
+    """Map every (dest, comp, jump) mnemonic triple to its 16 bit word."""
+    words = {}
+    for dest, dest_bits in DEST_CODES.items():
+        for comp, comp_bits in COMP_CODES.items():
+            a_bit = "1" if "M" in comp else "0"
+            for jump, jump_bits in JUMP_CODES.items():
+                words[dest, comp, jump] = int("111" + a_bit + comp_bits + dest_bits + jump_bits, 2)
+    return words
+
+
+def _build_c_text_words():
+    return {c_text(*fields): word for fields, word in _table("C_FIELD_WORDS").items()}
+
+
+def _build_c_lines():
+    return {text: format(word, "016b") for text, word in _table("C_WORDS").items()}
+
+
+def _build_a_lines():
+    return tuple(format(x, "016b") for x in range(0x8000))
+
+
+def _build_c_word_lines():
+    c_lines = _table("C_LINES")
+    return {word: c_lines[text] for text, word in _table("C_WORDS").items()}
+
+
+# Tables built on first use, as most runs only need some of them:
+# C_FIELD_WORDS: (dest, comp, jump) -> 16 bit word, all 1792 combinations.
+# C_WORDS: cleaned C-instruction text -> 16 bit word, e.g. "D", "AM=M+1", "D;JGT".
+# C_LINES: cleaned C-instruction text -> ready made output line.
+# A_LINES: A-instruction constant -> ready made output line, for 0..32767.
+# C_WORD_LINES: C-instruction word -> ready made output line.
+_LAZY_TABLES = {
+    "C_FIELD_WORDS": _build_c_words,
+    "C_WORDS": _build_c_text_words,
+    "C_LINES": _build_c_lines,
+    "A_LINES": _build_a_lines,
+    "C_WORD_LINES": _build_c_word_lines,
+}
+
+
+def _table(name):
+    """Returns the lazy table name, building it the first time."""
+    try:
+        return globals()[name]
+    except KeyError:
+        table = globals()[name] = _LAZY_TABLES[name]()
+        return table
+
+
+def __getattr__(name):
+    """Lazy tables are built on first access, e.g. 'from assembler.code import A_LINES'."""
+    if name in _LAZY_TABLES:
+        return _table(name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+# Words 'Code.lines()' formatted without the tables, which it builds once
+# there were enough of them.
+_words_formatted = 0
+
+# Builtin symbol -> its address as 16 bits.
+BUILTIN_SYMBOLS = {symbol: format(address, "016b") for symbol, address in BUILTIN_WORDS.items()}
+
+
 class Code:
     """Translate Hack assembly language mnemonics into binary codes."""
 
@@ -105,10 +187,55 @@ class Code:
         """
         return JUMP_CODES[mnemonic]
 
+    @staticmethod
+    def c_word(command):
+        """Returns the 16 bit word of a cleaned C-command, e.g. "D=M;JGT".
+
+        :rtype: int
+        """
+        return _table("C_WORDS")[command]
+
+    @staticmethod
+    def c_line(command):
+        """Returns the output line of a cleaned C-command."""
+        return _table("C_LINES")[command]
+
+    @staticmethod
+    def a_line(x):
+        """Returns the output line of the A-command '@x' for a constant x."""
+        x = int(x)
+        if 0 <= x < 0x8000:
+            return _table("A_LINES")[x]
+        return Code.as_bin(x)
+
     @staticmethod
     def symbol(mnemonic):
         return BUILTIN_SYMBOLS[mnemonic]
 
+    @staticmethod
+    def symbol_word(mnemonic):
+        """Returns the address of a builtin symbol.
+
+        :rtype: int
+        """
+        return BUILTIN_WORDS[mnemonic]
+
+    @staticmethod
+    def lines(words):
+        """Returns the output lines (without line endings) of 16 bit words.
+
+        :rtype: list
+        """
+        global _words_formatted
+        if "A_LINES" not in globals():
+            _words_formatted += len(words)
+            if _words_formatted < 4096:
+                # Building the tables would take longer than formatting.
+                return [format(w, "016b") for w in words]
+        a_lines = _table("A_LINES")
+        c_lines = _table("C_WORD_LINES")
+        return [a_lines[w] if w < 0x8000 else c_lines.get(w) or format(w, "016b") for w in words]
+
     @staticmethod
     def as_bin(x, size=16):
         """Convert x to a 16 bit zero padded binary number."""
@@ -0,0 +1,137 @@
+"""A long running assembler serving requests over a Unix domain socket.
+
+e.g.
+python -m assembler.daemon &
+python -m assembler.client Prog.asm
+
+Starting Python and importing the assembler costs far more than assembling
+a small file, and every new process starts with cold Parser caches. The
+daemon pays both once. Requests and responses use the frames described in
+assembler.protocol. A connection can send any number of requests.
+
+Assembling is CPU bound, so requests run one at a time on a single worker
+thread. The event loop keeps accepting connections meanwhile, and the
+Parser caches, shared by all parsers, are only ever used by that thread.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from assembler import __version__, protocol, service
+
+
+class DaemonRunningError(Exception):
+    """Another daemon already listens on the socket."""
+
+
+class Daemon:
+    """Serves the requests of assembler.protocol on socket_path."""
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or protocol.default_socket_path()
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.requests = 0
+        self.stopped = None  # an asyncio.Event once serving
+        self.connections = {}  # task -> reader of every open connection
+
+    def remove_stale_socket(self):
+        """Remove a socket file left behind by a daemon that is gone.
+
+        :raises DaemonRunningError: if one still answers on it
+        """
+        if not os.path.exists(self.socket_path):
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(self.socket_path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.socket_path)
+                return
+        raise DaemonRunningError("A daemon is already listening on {}.".format(self.socket_path))
+
+    async def respond(self, request, body):
+        """Returns (response header, response body) of one request."""
+        op = request.get("op", "assemble")
+        if op == "assemble":
+            self.requests += 1
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.worker, service.handle, request, body)
+        if op == "ping":
+            return {"ok": True, "version": __version__, "pid": os.getpid(), "requests": self.requests}, b""
+        if op == "shutdown":
+            self.stopped.set()
+            return {"ok": True}, b""
+        return service.error(ValueError("Unknown op {!r}.".format(op))), b""
+
+    async def serve_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections[task] = reader
+        try:
+            while True:
+                try:
+                    request, body = await protocol.read(reader)
+                except asyncio.IncompleteReadError:
+                    break  # the client is done
+                header, data = await self.respond(request, body)
+                writer.write(protocol.pack(header, data))
+                await writer.drain()
+        except (ConnectionError, ValueError) as ex:  # ValueError: not a JSON header
+            print("Dropped a connection: {}".format(ex), file=sys.stderr)
+        except asyncio.CancelledError:  # close the connection before passing it on
+            writer.close()
+            await writer.wait_closed()
+            raise
+        finally:
+            del self.connections[task]
+            writer.close()
+
+    async def close_connections(self):
+        """End the open connections as if their clients were done and wait
+        for them, a request being assembled still gets its response.
+
+        Left open, they would be cancelled when the event loop shuts down.
+        """
+        for reader in self.connections.values():
+            reader.feed_eof()
+        if self.connections:
+            await asyncio.wait(list(self.connections))
+
+    async def serve(self):
+        """Serve until a shutdown request, SIGINT or SIGTERM."""
+        self.remove_stale_socket()
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stopped.set)
+        server = await asyncio.start_unix_server(self.serve_connection, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        print("Listening on {}".format(self.socket_path), file=sys.stderr)
+        try:
+            async with server:
+                await self.stopped.wait()
+                await self.close_connections()
+        finally:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.worker.shutdown()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Serve Hack assembly requests over a Unix socket.")
+    arg_parser.add_argument("--socket", metavar="PATH",
+                            help="socket to listen on (default: {})".format(protocol.default_socket_path()))
+    args = arg_parser.parse_args(argv)
+    try:
+        asyncio.run(Daemon(args.socket).serve())
+    except DaemonRunningError as ex:
+        print(ex, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
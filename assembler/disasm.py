@@ -0,0 +1,220 @@
+"""Turn ROMs back into Hack assembly.
+
+e.g.
+python -m assembler.disasm Prog.hack --sym Prog.sym -o Prog.asm
+
+The text of every one of the 65536 possible words is worked out once, by
+inverting COMP_CODES, DEST_CODES and JUMP_CODES, into a table. A ROM is then
+disassembled by looking its words up, a block at a time, straight from a
+'.hack' text file or a memory mapped raw image.
+
+The labels of a symbol map, e.g. the .sym file written by --sym, can be put
+back: "(NAME)" lines where they are defined, and '@NAME' for the A-command
+right before a jump to one of them, or loading an address too big for a
+constant. Other A-commands loading the address of a variable get its name
+as a comment, a number can't be told apart from a variable. Either way
+assembling the output gives the same ROM again.
+
+Words that aren't instructions, i.e. C-commands with unknown comp bits or
+without the two unused bits set, come out as '@word' with a comment. This
+assembler takes any 16 bit constant, so they assemble back into the same
+word, which is what a label above 32767 in a big ROM gives.
+"""
+import argparse
+import bisect
+import gzip
+import mmap
+import os
+import sys
+from array import array
+
+from assembler.code import COMP_CODES, DEST_CODES, JUMP_CODES, c_text
+from assembler.symbol_table import LABEL, VARIABLE
+
+BLOCK_SIZE = 1 << 16  # words disassembled at a time
+
+# The table of 'decode_table()', built on first use.
+_table = None
+
+
+def _invert(codes):
+    """Returns bits as an int -> mnemonic of a table of codes."""
+    return {int(bits, 2): mnemonic for mnemonic, bits in codes.items()}
+
+
+def _build_table():
+    # The A and M forms share the comp bits, the a bit in front tells them apart.
+    comps = _invert({mnemonic: ("1" if "M" in mnemonic else "0") + bits for mnemonic, bits in COMP_CODES.items()})
+    dests = _invert(DEST_CODES)
+    jumps = _invert(JUMP_CODES)
+
+    table = ["@{}".format(word) for word in range(0x8000)]
+    for word in range(0x8000, 0x10000):
+        comp = comps.get((word >> 6) & 0x7F)
+        if comp is None or word < 0xE000:
+            table.append("@{} // not an instruction".format(word))
+        else:
+            table.append(c_text(dests[(word >> 3) & 0x7], comp, jumps[word & 0x7]))
+    return table
+
+
+def decode_table():
+    """Returns the text of every 16 bit word, indexed by the word.
+
+    :rtype: list
+    """
+    global _table
+    if _table is None:
+        _table = _build_table()
+    return _table
+
+
+def is_jump(word):
+    """Is word a C-command that can jump?"""
+    return word >= 0xE000 and word & 0x7 != 0
+
+
+def read_sym(file):
+    """Yields (name, address, kind) of the symbols in a .sym file, see
+    'SymbolTable.write_sym()'."""
+    with open(file) as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                name, address, kind = fields
+                yield name, int(address), kind
+
+
+def read_words(file, byteorder="little", block_size=BLOCK_SIZE):
+    """Yields the words of a ROM as array('H') blocks.
+
+    Files ending in .hack or .hack.gz are text, one binary word per line.
+    Anything else is a raw image of uint16 words in the given byte order,
+    like RawWriter writes, which is memory mapped.
+    """
+    if file.endswith(".hack") or file.endswith(".hack.gz"):
+        opener = gzip.open if file.endswith(".gz") else open
+        with opener(file, "rt") as f:
+            while True:
+                lines = f.readlines(block_size * 17)
+                if not lines:
+                    return
+                yield array("H", [int(line, 2) for line in lines if not line.isspace()])
+    with open(file, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size % 2:
+            raise ValueError("{} is not a ROM image, it has an odd number of bytes.".format(file))
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for start in range(0, size, 2 * block_size):
+                words = array("H")
+                words.frombytes(mm[start:start + 2 * block_size])
+                if byteorder != sys.byteorder:
+                    words.byteswap()
+                yield words
+
+
+class Disassembler:
+    """Disassembles words, with the labels and variables of symbols put back.
+
+    symbols are (name, address, kind) like 'SymbolTable.symbols()' or
+    'read_sym()' give, only labels and variables are used.
+    """
+
+    def __init__(self, symbols=()):
+        table = decode_table()
+        self.lines = [text + "\n" for text in table]
+        self.labels = {}  # address -> names of the labels there
+        self.variables = {}  # address -> name
+        for name, address, kind in symbols:
+            if kind == LABEL:
+                self.labels.setdefault(address, []).append(name)
+            elif kind == VARIABLE:
+                self.variables[address] = name
+        self.label_addresses = sorted(self.labels)
+
+    def text(self, words, address=0, next_word=None):
+        """Returns the disassembly of words, the first one being at ROM
+        address. next_word is the word after them, None at the end of the
+        ROM, to tell if the last one is the target of a jump.
+
+        :rtype: str
+        """
+        if not self.labels and not self.variables:
+            return "".join(map(self.lines.__getitem__, words))
+        lines = list(map(self.lines.__getitem__, words))
+        labels = self.labels
+        variables = self.variables
+        last = len(words) - 1
+        for i, word in enumerate(words):
+            if (word in labels or word in variables) and lines[i][0] == "@":
+                following = words[i + 1] if i < last else next_word
+                # Above 32767 it can't be a constant, it has to be the label.
+                if word in labels and (word >= 0x8000 or following is not None and is_jump(following)):
+                    lines[i] = "@{}\n".format(labels[word][0])
+                elif word in variables:
+                    lines[i] = "@{} // {}\n".format(word, variables[word])
+
+        # Label definitions, from the last so the indexes stay right.
+        start = bisect.bisect_left(self.label_addresses, address)
+        stop = bisect.bisect_left(self.label_addresses, address + len(words))
+        for label_address in reversed(self.label_addresses[start:stop]):
+            i = label_address - address
+            lines[i:i] = ["({})\n".format(name) for name in labels[label_address]]
+        return "".join(lines)
+
+    def stream(self, blocks):
+        """Yields the disassembly of blocks of words, in pieces.
+
+        Labels defined at the end of the ROM, e.g. by a last "(END)", come
+        at the very end.
+        """
+        address = 0
+        held = None  # last word so far, its successor isn't known yet
+        for words in blocks:
+            if not words:
+                continue
+            if held is not None:
+                yield self.text((held,), address - 1, words[0])
+            held = words[-1]
+            yield self.text(words[:-1], address, held)
+            address += len(words)
+        if held is not None:
+            yield self.text((held,), address - 1)
+        yield "".join("({})\n".format(name) for name in self.labels.get(address, ()))
+
+    def disassemble(self, words):
+        """Returns the disassembly of a whole ROM.
+
+        :rtype: str
+        """
+        return "".join(self.stream([words]))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Disassemble a Hack ROM.")
+    arg_parser.add_argument("rom", help=".hack or .hack.gz text file or raw image")
+    arg_parser.add_argument("-o", "--output", metavar="FILE", help="the assembly (default: stdout)")
+    arg_parser.add_argument("--sym", metavar="FILE", help="put the labels and variables of a .sym file back")
+    arg_parser.add_argument("--byteorder", choices=["little", "big"], default="little",
+                            help="of a raw image (default: %(default)s)")
+    args = arg_parser.parse_args(argv)
+
+    try:
+        disassembler = Disassembler(read_sym(args.sym) if args.sym else ())
+        out_f = open(args.output, "w") if args.output else sys.stdout
+        try:
+            for text in disassembler.stream(read_words(args.rom, args.byteorder)):
+                out_f.write(text)
+        finally:
+            if out_f is not sys.stdout:
+                out_f.close()
+    except (OSError, ValueError) as ex:
+        print(ex, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,342 @@
+"""Run assembled Hack ROMs.
+
+e.g.
+python -m assembler.emulator Prog.hack --cycles 1000000 --dump ram.bin
+
+Every ROM word is decoded once up front, through tables keyed on the comp,
+dest and jump bits of COMP_CODES, DEST_CODES and JUMP_CODES, into a line of
+Python source. Runs of instructions are then compiled into one Python
+function each, the first time execution reaches them. Running a block is
+one call that does no decoding at all:
+
+def block(R, A, D):  # (LOOP) @i M=M+1 D=M @LOOP D;JGT at address 2
+    A = 16
+    R[A] = (R[A] + 1) & 65535
+    D = R[A]
+    A = 2
+    v = D
+    if 0 < v < 32768:
+        return 2, A, D, 5
+    return 7, A, D, 5
+
+Registers and memory hold unsigned 16 bit values, negative numbers are
+their two's complement, so 'D < 0' is 'D >= 32768'.
+
+A jump to itself right after loading its own address, i.e. "(END) @END
+0;JMP", is how Hack programs stop. 'Emulator.run()' stops there too, as it
+does when the program counter leaves the ROM or after max_cycles.
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+from array import array
+from collections import namedtuple
+
+from assembler.code import BUILTIN_WORDS, COMP_CODES, DEST_CODES, JUMP_CODES
+from assembler.writers import WRITERS
+
+RAM_SIZE = 0x10000
+SCREEN = BUILTIN_WORDS["SCREEN"]
+SCREEN_SIZE = 8192  # 256 rows of 32 words
+KBD = BUILTIN_WORDS["KBD"]
+MAX_BLOCK_SIZE = 256  # instructions compiled into a single function
+
+
+def _comp_expressions():
+    """Map the 7 comp bits (a + cccccc) to a Python expression.
+
+    Only the A forms are written out, the M forms are the same with R[A]
+    for A, and the a bit set.
+    """
+    expressions = {
+        "0": "0",
+        "1": "1",
+        "-1": "65535",
+        "D": "D",
+        "A": "A",
+        "!D": "D ^ 65535",
+        "!A": "A ^ 65535",
+        "-D": "-D & 65535",
+        "-A": "-A & 65535",
+        "D+1": "(D + 1) & 65535",
+        "A+1": "(A + 1) & 65535",
+        "D-1": "(D - 1) & 65535",
+        "A-1": "(A - 1) & 65535",
+        "D+A": "(D + A) & 65535",
+        "D-A": "(D - A) & 65535",
+        "A-D": "(A - D) & 65535",
+        "D&A": "D & A",
+        "D|A": "D | A",
+    }
+    table = {}
+    for mnemonic, bits in COMP_CODES.items():
+        if "M" in mnemonic:
+            expression = expressions[mnemonic.replace("M", "A")].replace("A", "R[A]")
+            table[int("1" + bits, 2)] = expression
+        else:
+            table[int("0" + bits, 2)] = expressions[mnemonic]
+    return table
+
+
+# comp bits -> expression of the ALU output.
+COMP_EXPRESSIONS = _comp_expressions()
+
+# dest bits -> registers written, memory first since it is addressed by the old A.
+DEST_TARGETS = {int(bits, 2): [target for register, target in (("M", "R[A]"), ("D", "D"), ("A", "A"))
+                               if register in mnemonic]
+                for mnemonic, bits in DEST_CODES.items()}
+
+# jump bits -> condition on the ALU output v, None for no jump.
+JUMP_CONDITIONS = {int(bits, 2): condition for bits, condition in (
+    (JUMP_CODES["null"], None),
+    (JUMP_CODES["JGT"], "0 < v < 32768"),
+    (JUMP_CODES["JEQ"], "v == 0"),
+    (JUMP_CODES["JGE"], "v < 32768"),
+    (JUMP_CODES["JLT"], "v >= 32768"),
+    (JUMP_CODES["JNE"], "v != 0"),
+    (JUMP_CODES["JLE"], "not 0 < v < 32768"),
+    (JUMP_CODES["JMP"], "True"),
+)}
+
+
+class EmulatorError(Exception):
+    """The ROM holds a word the CPU can't execute."""
+
+
+Decoded = namedtuple("Decoded", ["lines", "condition", "target", "constant"])
+
+Snapshot = namedtuple("Snapshot", ["pc", "a", "d", "cycles", "ram"])
+
+
+def decode(word):
+    """Returns the Decoded source of one ROM word.
+
+    lines are the Python statements run for it. condition is None, or the
+    jump condition checked after them, with target the register holding
+    the jump address. constant is the value loaded into A by an
+    A-instruction, None for anything else.
+    """
+    if word < 0x8000:
+        return Decoded(["A = {}".format(word)], None, None, word)
+    comp = (word >> 6) & 0x7F
+    targets = DEST_TARGETS[(word >> 3) & 0x7]
+    condition = JUMP_CONDITIONS[word & 0x7]
+    try:
+        expression = COMP_EXPRESSIONS[comp]
+    except KeyError:
+        return Decoded(["raise EmulatorError({!r})".format(
+            "Illegal instruction {:016b}, unknown comp bits.".format(word))], None, None, None)
+
+    if condition is None:
+        if len(targets) == 1:
+            return Decoded(["{} = {}".format(targets[0], expression)], None, None, None)
+        lines = ["v = " + expression] if targets else []
+        return Decoded(lines + ["{} = v".format(target) for target in targets], None, None, None)
+
+    lines = ["v = " + expression]
+    target = "A"
+    if "A" in targets:
+        lines.append("t = A")  # the jump goes to the address A held before
+        target = "t"
+    lines += ["{} = v".format(t) for t in targets]
+    return Decoded(lines, condition, target, None)
+
+
+def load_rom(file, byteorder="little"):
+    """Returns the words of a '.hack' (or '.hack.gz') text file or raw image.
+
+    Anything not ending in .hack or .hack.gz is taken to be a raw image of
+    uint16 words in the given byte order, like RawWriter writes.
+
+    :rtype: array('H')
+    """
+    if file.endswith(".hack") or file.endswith(".hack.gz"):
+        opener = gzip.open if file.endswith(".gz") else open
+        with opener(file, "rt") as f:
+            return array("H", (int(line, 2) for line in f if line.strip()))
+    rom = array("H")
+    with open(file, "rb") as f:
+        rom.frombytes(f.read())
+    if byteorder != sys.byteorder:
+        rom.byteswap()
+    return rom
+
+
+class Emulator:
+    """A Hack CPU with its ROM, 64K words of RAM and the registers.
+
+    rom is anything that gives 16 bit words, e.g. 'two_pass()' output or
+    'load_rom()'. SCREEN and KBD are memory mapped at their usual addresses.
+    """
+
+    def __init__(self, rom):
+        self.rom = array("H", rom)
+        self.ram = array("H", bytes(2 * RAM_SIZE))
+        self.pc = 0
+        self.a = 0
+        self.d = 0
+        self.cycles = 0
+        self.halted = False
+        decoded = {word: decode(word) for word in set(self.rom)}
+        # The dispatch table, one decoded instruction per ROM word.
+        self.code = [decoded[word] for word in self.rom]
+        self.blocks = [None] * len(self.rom)  # (function, size, halts) by start address
+
+    def compile(self, start, size=MAX_BLOCK_SIZE):
+        """Returns (function, size, halts) of the block of code at start.
+
+        The function returns the next program counter, the registers and
+        the number of instructions it ran. A conditional jump leaves the
+        function when taken. An unconditional jump to an address loaded
+        just before, like "@LOOP 0;JMP", is followed at compile time, so a
+        loop back to start is unrolled into one function. Anything else ends
+        the block, as does the end of the ROM or reaching size instructions,
+        which is the most a call can run. halts is True for "@start 0;JMP".
+        """
+        code = self.code
+        rom = self.rom
+        lines = ["def block(R, A, D):"]
+        pc = start
+        count = 0
+        constant = None  # value of A when known at compile time
+        loop_size = None  # instructions in one trip around a loop back to start
+        while pc < len(code) and count < size:
+            decoded = code[pc]
+            if decoded.constant is not None:
+                constant = decoded.constant
+            elif rom[pc] & 0x20:  # the A bit of dest
+                constant = None
+            pc += 1
+            count += 1
+            lines += ["    " + line for line in decoded.lines]
+            if decoded.condition is None:
+                continue
+            target = decoded.target
+            if target == "A" and constant is not None:
+                target = constant
+            if decoded.condition != "True":
+                lines.append("    if {}:".format(decoded.condition))
+                lines.append("        return {}, A, D, {}".format(target, count))
+                continue
+            if target == start:
+                # Unroll whole trips only, so blocks keep starting at start.
+                loop_size = loop_size or count
+                if count + loop_size <= size:
+                    pc = target
+                    continue
+            elif target != decoded.target and target < len(code) and not self.halts_at(target):
+                pc = target
+                continue
+            lines.append("    return {}, A, D, {}".format(target, count))
+            break
+        else:
+            lines.append("    return {}, A, D, {}".format(pc, count))
+        namespace = {"EmulatorError": EmulatorError}
+        exec(compile("\n".join(lines), "<block {}>".format(start), "exec"), namespace)
+        return namespace["block"], count, self.halts_at(start)
+
+    def halts_at(self, address):
+        """Returns True when the code at address is "@address 0;JMP"."""
+        rom = self.rom
+        return (address + 1 < len(rom) and rom[address] == address and (rom[address + 1] >> 3) & 0x7 == 0
+                and self.code[address + 1].condition == "True")
+
+    def run(self, max_cycles=None):
+        """Run until the program halts, leaves the ROM or after max_cycles.
+
+        :returns the number of instructions executed
+        """
+        R = self.ram
+        pc, A, D = self.pc, self.a, self.d
+        blocks = self.blocks
+        rom_size = len(blocks)
+        left = float("inf") if max_cycles is None else max_cycles
+        executed = 0
+        self.halted = False
+        try:
+            while pc < rom_size and executed < left:
+                block = blocks[pc]
+                if block is None:
+                    block = blocks[pc] = self.compile(pc)
+                function, size, halts = block
+                if halts:
+                    self.halted = True
+                    break
+                if executed + size > left:
+                    # The whole block might not fit the cycle limit.
+                    function = self.compile(pc, left - executed)[0]
+                pc, A, D, count = function(R, A, D)
+                executed += count
+        finally:
+            self.pc, self.a, self.d = pc, A, D
+            self.cycles += executed
+        return executed
+
+    def reset(self):
+        """Set the program counter back to 0, RAM and registers are kept."""
+        self.pc = 0
+        self.halted = False
+
+    def press(self, key):
+        """Hold down the key with the given Hack key code, 0 to release it."""
+        self.ram[KBD] = key
+
+    def screen(self):
+        """Returns the SCREEN memory map, 32 words per row of 512 pixels.
+
+        :rtype: memoryview
+        """
+        return memoryview(self.ram)[SCREEN:SCREEN + SCREEN_SIZE]
+
+    def snapshot(self):
+        """Returns a copy of the machine state, see 'restore()'.
+
+        :rtype: Snapshot
+        """
+        return Snapshot(self.pc, self.a, self.d, self.cycles, array("H", self.ram))
+
+    def restore(self, snapshot):
+        self.pc, self.a, self.d, self.cycles = snapshot.pc, snapshot.a, snapshot.d, snapshot.cycles
+        self.ram[:] = snapshot.ram
+        self.halted = False
+
+    def dump(self, out_file, start=0, stop=RAM_SIZE, format="raw"):
+        """Write RAM[start:stop] to out_file, in any of the WRITERS formats."""
+        WRITERS[format].write(out_file, self.ram[start:stop])
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Run a Hack ROM.")
+    arg_parser.add_argument("rom", help=".hack text file or raw .bin image")
+    arg_parser.add_argument("--byteorder", choices=["little", "big"], default="little",
+                            help="of a raw image (default: %(default)s)")
+    arg_parser.add_argument("--cycles", type=int, help="stop after this many instructions")
+    arg_parser.add_argument("--set", action="append", default=[], metavar="ADDRESS=VALUE",
+                            help="store VALUE in RAM[ADDRESS] before running, can be repeated")
+    arg_parser.add_argument("--dump", metavar="FILE", help="write the RAM to FILE when done")
+    arg_parser.add_argument("--dump-range", default="0:{}".format(RAM_SIZE), metavar="START:STOP",
+                            help="part of the RAM to dump (default: %(default)s)")
+    arg_parser.add_argument("--format", choices=WRITERS, default="raw",
+                            help="format of the RAM dump (default: %(default)s)")
+    args = arg_parser.parse_args(argv)
+
+    emulator = Emulator(load_rom(args.rom, args.byteorder))
+    for assignment in args.set:
+        address, value = (int(x, 0) for x in assignment.split("="))
+        emulator.ram[address] = value & 0xFFFF
+    start = time.perf_counter()
+    executed = emulator.run(args.cycles)
+    seconds = time.perf_counter() - start
+    state = "halted" if emulator.halted else "stopped"
+    print("{} at pc {} after {} instructions, A={} D={} ({:.0f} instructions/s)".format(
+        state, emulator.pc, executed, emulator.a, emulator.d, executed / seconds if seconds else 0))
+    if args.dump:
+        dump_start, dump_stop = (int(x, 0) for x in args.dump_range.split(":"))
+        emulator.dump(args.dump, dump_start, dump_stop, args.format)
+        print("RAM[{}:{}] written to {}".format(dump_start, dump_stop, os.path.abspath(args.dump)))
+
+
+if __name__ == "__main__":
+    main()
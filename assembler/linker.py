@@ -0,0 +1,285 @@
+"""Separate compilation: relocatable object files and a linker.
+
+e.g.
+python -m assembler.linker Main.asm lib/*.asm -o Prog.hack
+
+Every module is assembled on its own into an object file next to it
+(Main.asm -> Main.o), and only when the object is missing or older than the
+source. Stale modules are assembled in parallel. The objects are then
+linked in the order given, into the same ROM as assembling all the modules
+concatenated in that order, except that a label may only be defined in one
+module.
+
+An object holds the module's encoded words and:
+- relocations: offsets of words holding the module relative address of
+  one of its own labels. Linking adds the module's ROM base.
+- externals: offsets of words holding an index into imports, the symbols
+  the module uses but doesn't define. Linking puts in the address of the
+  label another module defines, or else of a variable. Variables get RAM
+  addresses from 16 up, in first-use order over all modules.
+- labels: (name, module relative address) of the labels it defines.
+
+The file format, all integers little endian:
+HEADER, then words as uint16, relocations, externals and label addresses
+as uint32, then the label names followed by the import names, each
+terminated by a newline, in UTF-8.
+"""
+import argparse
+import os
+import struct
+import sys
+from array import array
+
+from assembler import stats
+from assembler.parser import InvalidCommandError, Parser
+from assembler.passes import constant_error, encode_c, scan_labels
+from assembler.symbol_table import VARIABLE, SymbolTable
+from assembler.writers import WRITERS
+
+MAGIC = b"HACKOBJ1"
+# magic, number of words, relocations, externals, labels, imports
+HEADER = struct.Struct("<8sIIIII")
+SUFFIX = ".o"
+
+
+class LinkError(Exception):
+    """The objects can't be linked, e.g. two define the same label."""
+
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class ObjectFile:
+    """A relocatable module, see the module docstring.
+
+    words is an array('H'), relocations and externals are array('I') of
+    offsets into words, labels a list of (name, address) and imports a list
+    of names.
+    """
+
+    def __init__(self, words, relocations, externals, labels, imports):
+        self.words = words
+        self.relocations = relocations
+        self.externals = externals
+        self.labels = labels
+        self.imports = imports
+
+    def dumps(self):
+        """Returns the object file as bytes.
+
+        :rtype: bytes
+        """
+        names = "".join(name + "\n" for name, _ in self.labels) + "".join(name + "\n" for name in self.imports)
+        return b"".join([
+            HEADER.pack(MAGIC, len(self.words), len(self.relocations), len(self.externals),
+                        len(self.labels), len(self.imports)),
+            _little_endian(self.words),
+            _little_endian(self.relocations),
+            _little_endian(self.externals),
+            _little_endian(array("I", [address for _, address in self.labels])),
+            names.encode("utf-8"),
+        ])
+
+    @classmethod
+    def loads(cls, data):
+        """Returns the ObjectFile of bytes data as written by 'dumps()'."""
+        magic, *counts = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a Hack object file.")
+        offset = HEADER.size
+        arrays = []
+        for typecode, count in zip("HIII", counts):
+            values = array(typecode)
+            end = offset + count * values.itemsize
+            values.frombytes(data[offset:end])
+            if sys.byteorder != "little":
+                values.byteswap()
+            arrays.append(values)
+            offset = end
+        words, relocations, externals, addresses = arrays
+        names = data[offset:].decode("utf-8").split("\n")
+        labels = list(zip(names, addresses))
+        imports = names[len(labels):counts[4] + len(labels)]
+        return cls(words, relocations, externals, labels, imports)
+
+    def write(self, file):
+        with open(file, "wb") as f:
+            f.write(self.dumps())
+
+    @classmethod
+    def read(cls, file):
+        with open(file, "rb") as f:
+            return cls.loads(f.read())
+
+
+def compile_module(file, parser=Parser):
+    """Assemble one module into an ObjectFile.
+
+    :rtype: ObjectFile
+    """
+    sym_table = SymbolTable()
+    with stats.phase("label_scan"):
+        scan_labels(file, sym_table, parser)
+    labels = sym_table.kinds  # only labels so far
+    imports = {}  # symbol -> index, in first-use order
+    words = array("H")
+    relocations = array("I")
+    externals = array("I")
+    with stats.phase("encode"):
+        with parser(file) as p:
+            for instruction in p.instructions():
+                kind = instruction.kind
+                if kind == "A_COMMAND":
+                    symbol = instruction.symbol
+                    word = sym_table.get(symbol)
+                    if word is None:
+                        word = imports.setdefault(symbol, len(imports))
+                        externals.append(len(words))
+                    elif symbol in labels:
+                        relocations.append(len(words))
+                    elif word > 0xFFFF:
+                        raise constant_error(instruction.line, symbol)
+                    words.append(word)
+                elif kind == "C_COMMAND":
+                    words.append(encode_c(instruction))
+                elif kind is None:
+                    raise InvalidCommandError(instruction.line)
+        stats.count("lines_read", p.line_count)
+    label_list = [(label, sym_table.get_address(label)) for label in labels]
+    return ObjectFile(words, relocations, externals, label_list, list(imports))
+
+
+def link(objects, names=None, sym_table=None):
+    """Link ObjectFiles into a ROM, in order.
+
+    names, the modules' names for error messages, default to their
+    positions. Pass an empty sym_table to get the symbols back, e.g. for
+    'SymbolTable.write_sym()'.
+
+    :rtype: array('H')
+    """
+    if names is None:
+        names = ["module {}".format(i) for i in range(len(objects))]
+    if sym_table is None:
+        sym_table = SymbolTable()
+
+    bases = []
+    size = 0
+    defined = {}  # label -> name of the module defining it
+    for obj, name in zip(objects, names):
+        bases.append(size)
+        for label, address in obj.labels:
+            if label in defined:
+                raise LinkError("Label '{}' is defined in both {} and {}.".format(label, defined[label], name))
+            defined[label] = name
+            sym_table.add_entry(label, size + address)
+        size += len(obj.words)
+    for obj in objects:
+        for symbol in obj.imports:
+            if not sym_table.contains(symbol):
+                sym_table.add_variable(symbol)
+
+    words = array("H")
+    for obj in objects:
+        words.extend(obj.words)
+    relocated = 0
+    for obj, base in zip(objects, bases):
+        addresses = [sym_table.get_address(symbol) for symbol in obj.imports]
+        for offset in obj.relocations:
+            words[base + offset] += base
+        for offset in obj.externals:
+            words[base + offset] = addresses[words[base + offset]]
+        relocated += len(obj.relocations) + len(obj.externals)
+    stats.count("relocations", relocated)
+    stats.count("variables", sym_table.count(VARIABLE))
+    return words
+
+
+def _compile_job(job):
+    """Runs in a worker process, compile source into object."""
+    source, obj = job
+    compile_module(source).write(obj)
+    return obj
+
+
+def object_file(source):
+    """Returns the object file name of source."""
+    return os.path.splitext(source)[0] + SUFFIX
+
+
+def is_stale(source, obj):
+    """Does source need to be assembled into obj again?"""
+    try:
+        return os.stat(obj).st_mtime_ns < os.stat(source).st_mtime_ns
+    except FileNotFoundError:
+        return True
+
+
+def compile_stale(sources, jobs=None):
+    """Compile the sources whose object file is out of date, in parallel.
+
+    Sources that are object files already are skipped.
+
+    :returns the sources compiled
+    """
+    stale = [(source, object_file(source)) for source in sources
+             if not source.endswith(SUFFIX) and is_stale(source, object_file(source))]
+    with stats.phase("compile"):
+        if len(stale) > 1 and jobs != 1:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                list(pool.map(_compile_job, stale))
+        else:
+            for job in stale:
+                _compile_job(job)
+    return [source for source, _ in stale]
+
+
+def build(sources, jobs=None, sym_table=None):
+    """Compile the stale ones of sources and link all of them.
+
+    :returns (ROM, list of the sources compiled)
+    """
+    compiled = compile_stale(sources, jobs)
+    objects = [source if source.endswith(SUFFIX) else object_file(source) for source in sources]
+    with stats.phase("link"):
+        words = link([ObjectFile.read(obj) for obj in objects], sources, sym_table)
+    return words, compiled
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Assemble Hack modules separately and link them.")
+    arg_parser.add_argument("modules", nargs="+", metavar="module",
+                            help=".asm sources, or {} object files, in link order".format(SUFFIX))
+    arg_parser.add_argument("-o", "--output", metavar="FILE", help="the linked ROM, required unless -c")
+    arg_parser.add_argument("--format", choices=WRITERS, default="hack",
+                            help="output format (default: %(default)s)")
+    arg_parser.add_argument("-c", "--compile-only", action="store_true",
+                            help="only bring the object files up to date")
+    arg_parser.add_argument("-j", "--jobs", type=int, metavar="N",
+                            help="processes assembling modules (default: one per core)")
+    args = arg_parser.parse_args(argv)
+    if args.output is None and not args.compile_only:
+        arg_parser.error("an --output file is required")
+
+    try:
+        if args.compile_only:
+            for source in compile_stale(args.modules, args.jobs):
+                print("{} -> {}".format(source, object_file(source)))
+            return 0
+        words, compiled = build(args.modules, args.jobs)
+    except (LinkError, OSError) as ex:
+        print(ex, file=sys.stderr)
+        return 1
+    WRITERS[args.format].write(args.output, words)
+    print("{} modules ({} assembled) linked into {}, {} words".format(
+        len(args.modules), len(compiled), args.output, len(words)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
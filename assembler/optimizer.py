@@ -0,0 +1,275 @@
+"""Peephole optimization of the parsed instructions, before encoding.
+
+Generated code, e.g. from a VM translator, is full of instructions that
+don't do anything. The rewrites, repeated until none applies:
+
+- Label aliasing: labels at the same address are merged into the first,
+  and a label whose code is just '@M' and an unconditional jump is
+  replaced by M wherever it is used. Labels nothing refers to are dropped.
+- Dead code: instructions after an unconditional jump are unreachable
+  up to the next label.
+- Redundant loads: '@X' when A already holds X since the last label or
+  assignment to A.
+- Jumps to the next instruction: a jump without dest whose target is the
+  label right after it.
+- Dead loads: '@X' directly followed by another A-command.
+
+The label addresses are resolved afresh on the optimized instructions.
+Variables keep the addresses they get from the unoptimized source, so the
+RAM layout doesn't change even if dead code held the first use of one.
+
+Only safe for code that jumps to labels: a jump to a constant address, or
+to a label address plus an offset, goes wrong once instructions before the
+target are removed.
+"""
+from array import array
+from collections import Counter
+
+from assembler import stats
+from assembler.code import BUILTIN_WORDS
+from assembler.parser import InvalidCommandError, Parser
+from assembler.passes import constant_error, encode_c
+from assembler.symbol_table import LABEL, VARIABLE, SymbolTable
+
+# Kinds of removed instructions, as reported by 'optimize()'.
+REWRITES = ["redundant_loads", "dead_loads", "jumps_to_next", "dead_code"]
+
+
+def _value(symbol):
+    """Returns what '@symbol' loads into A, as far as it's known before
+    the labels are resolved: a number, or else the symbol itself."""
+    if symbol in BUILTIN_WORDS:
+        return BUILTIN_WORDS[symbol]
+    if symbol.isdecimal():
+        return int(symbol)
+    return symbol
+
+
+def _is_goto(instruction):
+    """Is instruction an unconditional jump without side effects?"""
+    return instruction.kind == "C_COMMAND" and instruction.jump == "JMP" and instruction.dest == "null"
+
+
+def _skip_labels(program, i):
+    """Returns the index of the first instruction from i on that isn't a
+    label, len(program) if there is none."""
+    while i < len(program) and program[i].kind == "L_COMMAND":
+        i += 1
+    return i
+
+
+def alias_labels(program, duplicates):
+    """Returns program with every label replaced by the one it aliases.
+
+    Labels in duplicates are defined more than once and left alone.
+
+    :returns (program, number of labels aliased)
+    """
+    labels = {instruction.symbol for instruction in program if instruction.kind == "L_COMMAND"}
+    aliases = {}
+    first = None  # first label of the current run of labels
+    for i, instruction in enumerate(program):
+        if instruction.kind != "L_COMMAND":
+            first = None
+            continue
+        label = instruction.symbol
+        if label in duplicates:
+            continue
+        if first is None:
+            first = label
+            # Jump threading: the label only jumps on to another one.
+            j = _skip_labels(program, i + 1)
+            if (j + 1 < len(program) and program[j].kind == "A_COMMAND"
+                    and _is_goto(program[j + 1]) and program[j].symbol in labels
+                    and program[j].symbol not in duplicates):
+                aliases[label] = program[j].symbol
+        else:
+            aliases[label] = first
+
+    # Follow chains of aliases, a cycle is an endless loop and stays as is.
+    resolved = {}
+    for label in aliases:
+        target = label
+        seen = {label}
+        while target in aliases and aliases[target] not in seen:
+            target = aliases[target]
+            seen.add(target)
+        if target != label:
+            resolved[label] = target
+    if not resolved:
+        return program, 0
+    program = [instruction._replace(symbol=resolved[instruction.symbol])
+               if instruction.kind == "A_COMMAND" and instruction.symbol in resolved else instruction
+               for instruction in program]
+    return program, len(resolved)
+
+
+def remove_unused_labels(program):
+    """Returns program without the labels no A-command refers to."""
+    used = {instruction.symbol for instruction in program if instruction.kind == "A_COMMAND"}
+    return [instruction for instruction in program
+            if instruction.kind != "L_COMMAND" or instruction.symbol in used]
+
+
+def remove_dead_code(program, removed):
+    """Returns program without the instructions following an unconditional
+    jump up to the next label. Expects unused labels to be gone."""
+    result = []
+    reachable = True
+    for instruction in program:
+        kind = instruction.kind
+        if kind == "L_COMMAND":
+            reachable = True
+        elif not reachable:
+            removed["dead_code"] += 1
+            continue
+        elif kind == "C_COMMAND" and instruction.jump == "JMP":
+            reachable = False
+        result.append(instruction)
+    return result
+
+
+def remove_redundant_loads(program, removed, duplicates):
+    """Returns program without the A-commands loading what A already holds,
+    and without the jumps to the instruction right after them.
+
+    A jump to a label in duplicates is kept, the label might be defined
+    right after it but resolves to its last definition.
+    """
+    result = []
+    a = None  # value of A if known, see '_value()'
+    a_symbol = None
+    for i, instruction in enumerate(program):
+        kind = instruction.kind
+        if kind == "L_COMMAND":
+            a = a_symbol = None  # could be reached from anywhere
+        elif kind == "A_COMMAND":
+            value = _value(instruction.symbol)
+            if value == a:
+                removed["redundant_loads"] += 1
+                continue
+            a = value
+            a_symbol = instruction.symbol
+        else:
+            if instruction.jump != "null" and instruction.dest == "null" and a_symbol is not None:
+                next_labels = {label.symbol for label in program[i + 1:_skip_labels(program, i + 1)]}
+                if a_symbol in next_labels and a_symbol not in duplicates:
+                    removed["jumps_to_next"] += 1
+                    continue
+            if "A" in instruction.dest:
+                a = a_symbol = None
+        result.append(instruction)
+    return result
+
+
+def remove_dead_loads(program, removed):
+    """Returns program without the A-commands overwritten by the next
+    instruction that is executed."""
+    result = []
+    for i, instruction in enumerate(program):
+        if instruction.kind == "A_COMMAND":
+            j = _skip_labels(program, i + 1)
+            if j < len(program) and program[j].kind == "A_COMMAND":
+                removed["dead_loads"] += 1
+                continue
+        result.append(instruction)
+    return result
+
+
+def optimize(instructions):
+    """Optimize a list of Instructions, see the module docstring.
+
+    :returns (optimized list, Counter of the removed instructions by the
+             kinds in REWRITES, plus "aliased_labels")
+    """
+    for instruction in instructions:
+        if instruction.kind is None:
+            raise InvalidCommandError(instruction.line)
+    labels = Counter(instruction.symbol for instruction in instructions if instruction.kind == "L_COMMAND")
+    duplicates = {label for label, count in labels.items() if count > 1}
+
+    removed = Counter()
+    program = list(instructions)
+    while True:
+        size = len(program)
+        program, aliased = alias_labels(program, duplicates)
+        removed["aliased_labels"] += aliased
+        program = remove_unused_labels(program)
+        program = remove_dead_code(program, removed)
+        program = remove_redundant_loads(program, removed, duplicates)
+        program = remove_dead_loads(program, removed)
+        if len(program) == size:
+            return program, removed
+
+
+def allocate_variables(instructions, sym_table):
+    """Add the variables of instructions to sym_table from 16 up, in
+    first-use order."""
+    labels = {instruction.symbol for instruction in instructions if instruction.kind == "L_COMMAND"}
+    for instruction in instructions:
+        if instruction.kind == "A_COMMAND":
+            symbol = instruction.symbol
+            if symbol not in labels and sym_table.get(symbol) is None:
+                sym_table.add_variable(symbol)
+
+
+def encode(program, sym_table):
+    """Resolve the labels of program and encode it.
+
+    :rtype: array('H')
+    """
+    address = 0
+    for instruction in program:
+        if instruction.kind == "L_COMMAND":
+            sym_table.add_entry(instruction.symbol, address)
+        else:
+            address += 1
+    resolve = sym_table.resolve
+    words = array("H")
+    try:
+        for instruction in program:
+            kind = instruction.kind
+            if kind == "A_COMMAND":
+                words.append(resolve(instruction.symbol))
+            elif kind == "C_COMMAND":
+                words.append(encode_c(instruction))
+    except OverflowError:  # see 'passes.encode()'
+        raise constant_error(instruction.line, instruction.symbol) from None
+    return words
+
+
+def assemble(file, parser=Parser, sym_table=None):
+    """Assemble file with the peephole optimizations.
+
+    parser is the Parser class used to read the source, see 'two_pass()'
+    for sym_table.
+
+    :rtype: array('H')
+    """
+    if sym_table is None:
+        sym_table = SymbolTable()
+    with stats.phase("read"):
+        with parser(file) as p:
+            instructions = list(p.instructions())
+        stats.count("lines_read", p.line_count)
+    with stats.phase("optimize"):
+        program, removed = optimize(instructions)
+        allocate_variables(instructions, sym_table)
+    for name, count in removed.items():
+        stats.count("optimizer_" + name, count)
+    with stats.phase("encode"):
+        words = encode(program, sym_table)
+    stats.count("labels", sym_table.count(LABEL))
+    stats.count("variables", sym_table.count(VARIABLE))
+    return words
+
+
+if __name__ == "__main__":
+    from assembler.parser import SourceParser
+    from assembler.passes import two_pass
+
+    # A jump to a label defined twice goes to the last definition, even
+    # with the first one right after it.
+    source = "@L\n0;JMP\n(L)\n@x\nM=1\n(L)\n(END)\n@END\n0;JMP\n"
+    words = list(assemble(source, SourceParser))
+    assert words == list(two_pass(source, SourceParser)) == [4, 60039, 16, 61384, 4, 60039], words
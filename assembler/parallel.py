@@ -0,0 +1,155 @@
+"""Assemble one big source file on several cores.
+
+The file is split at line boundaries into byte ranges, one per process:
+
+1. Every chunk is label scanned in parallel. A worker returns its number
+   of instructions and lines, its labels with chunk relative addresses and
+   the A-command symbols that could be variables, in first-use order.
+2. A prefix sum of the instruction counts turns chunk addresses into ROM
+   addresses. The labels are merged in chunk order, so a label defined
+   twice keeps its last address, like 'two_pass()'.
+3. Variables get addresses from 16 up by walking the first-use lists in
+   chunk order and skipping labels and symbols already seen. That is the
+   global first-use order, the same one 'two_pass()' allocates in.
+4. Every chunk is encoded in parallel against the merged symbol table, and
+   the words are joined in chunk order.
+
+The result is the same as 'two_pass()'. Files too small to be worth the
+process pool are assembled with 'two_pass()' directly.
+"""
+import io
+import os
+from array import array
+from collections import namedtuple
+
+from assembler import stats
+from assembler.code import BUILTIN_WORDS
+from assembler.parser import MmapParser, Parser
+from assembler.passes import encode, two_pass
+from assembler.symbol_table import LABEL, VARIABLE, SymbolTable
+
+MIN_CHUNK_SIZE = 1 << 20  # bytes, smaller chunks don't pay for the processes
+
+# bytes [start, end) of file, starting at line number first_line.
+Chunk = namedtuple("Chunk", ["file", "start", "end", "first_line"])
+
+
+class ChunkParser(Parser):
+    """A Parser reading a single Chunk of a file.
+
+    The chunk is decoded the way Parser reads the whole file, so both see
+    the same lines.
+    """
+
+    def __init__(self, chunk):
+        super().__init__(chunk)
+        self.first_line = chunk.first_line
+
+    def __enter__(self):
+        chunk = self.file
+        with open(chunk.file, "rb") as f:
+            f.seek(chunk.start)
+            data = f.read(chunk.end - chunk.start)
+        self.fd = io.TextIOWrapper(io.BytesIO(data))
+        return self
+
+
+def split(file, parts, min_size=MIN_CHUNK_SIZE):
+    """Split file into at most parts Chunks of at least min_size bytes.
+
+    Chunks end right after a line feed. Their first_line is still unknown
+    and set to 1.
+
+    :rtype: list
+    """
+    size = os.path.getsize(file)
+    parts = max(1, min(parts, size // max(1, min_size)))
+    bounds = [0]
+    with open(file, "rb") as f:
+        for i in range(1, parts):
+            f.seek(max(size * i // parts, bounds[-1]))
+            f.readline()  # on to the start of the next line
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return [Chunk(file, start, end, 1) for start, end in zip(bounds, bounds[1:])]
+
+
+def scan_chunk(chunk):
+    """Label scan one chunk, runs in a worker process.
+
+    :returns (instructions, lines, labels, symbols), labels as (name, chunk
+             address) pairs and symbols the A-command symbols that are no
+             builtin or number, in first-use order
+    """
+    labels = []
+    symbols = {}  # as an ordered set
+    address = 0
+    with ChunkParser(chunk) as p:
+        for instruction in p.instructions():
+            kind = instruction.kind
+            if kind == "L_COMMAND":
+                labels.append((instruction.symbol, address))
+            elif kind is not None:
+                if kind == "A_COMMAND":
+                    symbol = instruction.symbol
+                    if symbol not in symbols and symbol not in BUILTIN_WORDS and not symbol.isdecimal():
+                        symbols[symbol] = None
+                address += 1
+    return address, p.line_count, labels, list(symbols)
+
+
+def encode_chunk(job):
+    """Encode one chunk, runs in a worker process.
+
+    job is (chunk, sym_table), with sym_table holding every label and variable.
+
+    :returns the words as bytes
+    """
+    chunk, sym_table = job
+    return encode(chunk, sym_table, ChunkParser).tobytes()
+
+
+def assemble(file, parser=Parser, jobs=None, min_chunk_size=MIN_CHUNK_SIZE):
+    """Assemble file with up to jobs processes, jobs defaults to the cores.
+
+    parser is only used when the file is assembled by 'two_pass()', the
+    chunks are always read by a ChunkParser. As chunks are cut from the
+    file's bytes, anything but a Parser or MmapParser reading the file as
+    it is, e.g. a SourceParser, gets 'two_pass()' as well.
+
+    :rtype: array('H')
+    """
+    if parser not in (Parser, MmapParser):
+        return two_pass(file, parser)
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = jobs or os.cpu_count() or 1
+    chunks = split(file, jobs, min_chunk_size)
+    if len(chunks) == 1:
+        return two_pass(file, parser)
+
+    with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+        with stats.phase("label_scan"):
+            scans = list(pool.map(scan_chunk, chunks))
+        sym_table = SymbolTable()
+        address = 0
+        line = 1
+        for i, (instructions, lines, labels, _) in enumerate(scans):
+            for name, chunk_address in labels:
+                sym_table.add_entry(name, address + chunk_address)
+            chunks[i] = chunks[i]._replace(first_line=line)
+            address += instructions
+            line += lines
+        stats.count("labels", sym_table.count(LABEL))
+        for _, _, _, used in scans:
+            for symbol in used:
+                if not sym_table.contains(symbol):
+                    sym_table.add_variable(symbol)
+        stats.count("variables", sym_table.count(VARIABLE))
+        stats.count("lines_read", 2 * (line - 1))  # once per pass, like 'two_pass()'
+
+        with stats.phase("encode"):
+            words = array("H")
+            for data in pool.map(encode_chunk, [(chunk, sym_table) for chunk in chunks]):
+                words.frombytes(data)
+    return words
@@ -1,10 +1,51 @@
-import pdb
+import io
+import mmap
 import warnings
-import functools
+from collections import namedtuple
 
 from assembler.utils import Utils, ManualCache
 
 
+class Instruction(namedtuple("Instruction", ["kind", "symbol", "dest", "comp", "jump", "line"])):
+    """A command parsed once, see 'Parser.instructions()'.
+
+    kind is A_COMMAND, C_COMMAND, L_COMMAND or None for an invalid command.
+    symbol is set for A- and L-commands. dest, comp and jump are set for
+    C-commands, with "null" for a left out dest or jump. line is the source
+    line number, or an Origin for a PreprocessingParser.
+
+    Immutable and without a per instance __dict__. The field strings are
+    shared through the Parser caches, so each record is little more than a
+    small tuple.
+    """
+    __slots__ = ()
+
+
+class InvalidCommandError(Exception):
+    """A command that isn't Hack assembly.
+
+    line is its line number and command its text, either can be None when
+    it isn't known. reason says what is wrong, if more than that.
+    """
+
+    def __init__(self, line=None, command=None, reason=None):
+        self.line = line
+        self.command = command
+        self.reason = reason
+        message = "Messed up binary code"
+        if line is not None:
+            message += " on line {}".format(line)
+        if command is not None:
+            message += ": {!r}".format(command)
+        if reason is not None:
+            message += ", " + reason
+        super().__init__(message + ".")
+
+    def __reduce__(self):
+        # Rebuilt from the fields, e.g. when raised in a worker process.
+        return type(self), (self.line, self.command, self.reason)
+
+
 class Parser:
     """Encapsulates the access to input code.
 
@@ -17,6 +58,8 @@ class Parser:
     """
     command_type_cache = ManualCache(max_size=2048)
     clean_cache = ManualCache(max_size=2048)
+    fields_cache = ManualCache(max_size=2048)
+    first_line = 1  # line number of the first input line, for Instruction.line
 
     def __init__(self, file):
         """Opens the input file and gets ready to parse it.
@@ -31,6 +74,32 @@ class Parser:
         self.file = file
         self.command = None
         self.last_read_location = None
+        self.line_count = 0  # lines read, for stats
+
+    @classmethod
+    def with_caches(cls, max_size=2048):
+        """Returns a subclass of cls with caches of its own.
+
+        Its parsers share them with nobody else, e.g. to use it from one
+        thread while other threads parse too.
+        """
+        caches = {name: ManualCache(max_size=max_size) for name in cls.caches()}
+        return type(cls.__name__, (cls,), caches)
+
+    @classmethod
+    def caches(cls):
+        """Returns the caches shared by all parsers of cls, by name."""
+        return {
+            "command_type_cache": cls.command_type_cache,
+            "clean_cache": cls.clean_cache,
+            "fields_cache": cls.fields_cache,
+        }
+
+    @classmethod
+    def resize_caches(cls, max_size):
+        """Set the maxsize of every shared cache."""
+        for cache in cls.caches().values():
+            cache.resize(max_size)
 
     def has_more_commands(self):
         """Are there more commands in the input?
@@ -72,18 +141,11 @@ class Parser:
         L_COMMAND for (actually pseudo for (Xxx) where Xxx is a symbol.
         """
         try:
-            return Parser.command_type_cache[self.command]  # try for cached value
+            return self.command_type_cache[self.command]  # try for cached value
         except KeyError:
             pass
-        if Utils.a_command.fullmatch(self.command):
-            type_ = "A_COMMAND"
-        elif Utils.c_command.fullmatch(self.command):
-            type_ = "C_COMMAND"
-        elif Utils.l_command.fullmatch(self.command):
-            type_ = "L_COMMAND"
-        else:
-            type_ = None
-        Parser.command_type_cache[self.command] = type_  # update cache
+        type_ = self.parse_fields(self.command)[0]
+        self.command_type_cache[self.command] = type_  # update cache
         return type_
 
     def symbol(self):
@@ -146,20 +208,116 @@ class Parser:
             return self.command.split(';')[1] if ";" in self.command else "null"
         raise Exception("Invalid 'command_type()'.")
 
+    def fields(self):
+        """Returns (kind, symbol, dest, comp, jump) of the current command.
+
+        Classifies and splits the command once, unlike calling
+        'command_type()', 'symbol()', 'dest()', 'comp()' and 'jump()'.
+        """
+        try:
+            return self.fields_cache[self.command]  # try for cached value
+        except KeyError:
+            pass
+        fields = self.parse_fields(self.command)
+        self.fields_cache[self.command] = fields  # update cache
+        return fields
+
+    @staticmethod
+    def parse_fields(command):
+        """Returns (kind, symbol, dest, comp, jump) of a cleaned command, uncached.
+
+        A single match of the combined 'Utils.command' tokenizer.
+        """
+        match = Utils.command.fullmatch(command)
+        if match is None:
+            return None, None, None, None, None
+        return Parser.match_fields(match)
+
+    @staticmethod
+    def match_fields(match):
+        """Returns the fields of a 'Utils.command' or 'Utils.line' match.
+
+        None when the match holds no command, i.e. an empty or comment line.
+        """
+        a, l, dest, comp, jump = match.group("a", "l", "dest", "comp", "jump")
+        if a is not None:
+            return "A_COMMAND", a, None, None, None
+        if comp is not None:
+            return "C_COMMAND", None, dest or "null", comp, jump or "null"
+        if l is not None:
+            return "L_COMMAND", l, None, None, None
+        return None
+
+    def tokenize(self, line):
+        """Returns the fields of a raw source line, None when it is empty.
+
+        Cleaning and classifying take one 'Utils.line' match. Only lines
+        that don't match, e.g. with whitespace inside the command or an
+        invalid command, are cleaned first and then parsed.
+        """
+        match = Utils.line.fullmatch(line)
+        if match is not None:
+            return self.match_fields(match)
+        self.command = line
+        self.clean()
+        if not self.command:
+            return None
+        return self.fields()
+
+    def instruction(self, line=None):
+        """Returns the current command as an Instruction."""
+        return Instruction._make(self.fields() + (line,))
+
+    def instructions(self):
+        """Yields every non empty command of the input as an Instruction.
+
+        with Parser(file) as p:
+            for instruction in p.instructions():
+                etc.
+        """
+        new = tuple.__new__
+        cache = self.fields_cache  # raw lines as keys, next to cleaned commands
+        tokenize = self.tokenize
+        first = line = self.first_line - 1
+        try:
+            for raw in self.lines():
+                line += 1
+                try:
+                    fields = cache[raw]
+                except KeyError:
+                    fields = cache[raw] = tokenize(raw)
+                if fields is not None:
+                    yield new(Instruction, fields + (line,))
+        finally:
+            self.line_count += line - first
+
     def clean(self):
         """Remove all whitespace and comments from current line."""
         # pdb.set_trace()
         try:
-            self.command = Parser.clean_cache[self.command]  # try for cached value
+            self.command = self.clean_cache[self.command]  # try for cached value
             return True
         except KeyError:
             pass
         line = self.command[:]
         line = line.split("//")[0]
         line = ''.join(line.split())
-        Parser.clean_cache[self.command] = line  # update cache
+        self.clean_cache[self.command] = line  # update cache
         self.command = line
 
+    def commands(self):
+        """Returns every non empty cleaned command of the input at once.
+
+        Cleans the same way as 'clean()' but in bulk, which is quicker
+        when the whole source is needed anyway.
+
+        :rtype: list
+        """
+        lines = self.fd.read().split("\n")
+        self.line_count += len(lines)
+        lines = [''.join(line.split("//")[0].split()) for line in lines]
+        return [line for line in lines if line]
+
     def __enter__(self):
         self.fd = open(self.file, "r")
         return self  # or self.fd ..
@@ -167,12 +325,103 @@ class Parser:
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.fd.close()
 
+    def lines(self):
+        """Returns the raw lines of the input."""
+        return self.fd
+
     def __iter__(self):
         """When used in a for loop returns file object.
 
         Maybe I should add line cleanup here too?
         """
-        for line in self.fd:
+        for line in self.lines():
+            self.line_count += 1
             self.command = line
             self.clean()
             yield self.command
+
+
+class MmapParser(Parser):
+    """A Parser that memory maps the input file and cleans raw bytes.
+
+    Lines are tokenized as ASCII bytes straight out of the map, so there is
+    no per-line decoding of the whole source text. Only the cleaned command
+    is turned into a str, which for ASCII is a plain copy. Lines holding
+    other characters fall back to the same str cleaning Parser does.
+
+    Yields the same cleaned commands as Parser:
+    with MmapParser(file) as p:
+        for command in p:
+            etc.
+
+    Unlike text mode, a lone carriage return does not end a line.
+    """
+
+    def __init__(self, file):
+        super().__init__(file)
+        self.mm = None
+
+    def clean(self):
+        """Remove all whitespace and comments from current (bytes) line."""
+        try:
+            self.command = self.clean_cache[self.command]  # try for cached value
+            return True
+        except KeyError:
+            pass
+        raw = self.command
+        line = b''.join(raw.split(b"//", 1)[0].split())
+        if line.isascii():
+            line = line.decode("ascii")
+        else:
+            line = raw.decode()
+            line = ''.join(line.split("//")[0].split())
+        self.clean_cache[raw] = line  # update cache
+        self.command = line
+
+    def commands(self):
+        """Returns every non empty cleaned command of the input at once.
+
+        :rtype: list
+        """
+        return [command for command in self if command]
+
+    def tokenize(self, line):
+        """Returns the fields of a raw bytes line, None when it is empty."""
+        self.command = line
+        self.clean()
+        if not self.command:
+            return None
+        return self.fields()
+
+    def __enter__(self):
+        self.fd = open(self.file, "rb")
+        try:
+            self.mm = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # an empty file can't be mapped
+            self.mm = None
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.mm is not None:
+            self.mm.close()
+        self.fd.close()
+
+    def lines(self):
+        if self.mm is None:
+            return ()
+        return iter(self.mm.readline, b"")
+
+
+class SourceParser(Parser):
+    """A Parser reading source text held in memory instead of a file.
+
+    file is the source itself, so it can be handed to the passes like a
+    Parser class:
+    words = two_pass(source, SourceParser)
+
+    Line endings are translated the same way as reading a file in text mode.
+    """
+
+    def __enter__(self):
+        self.fd = io.StringIO(self.file, newline=None)
+        return self
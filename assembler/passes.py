@@ -0,0 +1,161 @@
+from array import array
+
+from assembler import code, stats
+from assembler.code import Code
+from assembler.parser import InvalidCommandError, Parser
+from assembler.symbol_table import LABEL, SymbolTable
+
+
+def scan_labels(file, sym_table, parser=Parser):
+    """First pass: add the ROM address of every (LABEL) to the symbol table."""
+    address = 0
+    with parser(file) as p:
+        for instruction in p.instructions():
+            kind = instruction.kind
+            if kind == "L_COMMAND":
+                sym_table.add_entry(instruction.symbol, address)
+            elif kind is not None:
+                address += 1
+    stats.count("lines_read", p.line_count)
+
+
+def constant_error(line, symbol):
+    """Returns the InvalidCommandError of '@symbol' on line, whose value
+    doesn't fit in a 16 bit word."""
+    return InvalidCommandError(line, "@" + symbol, "the value doesn't fit in 16 bits")
+
+
+def encode_c(instruction):
+    """Return the 16 bit word of a C-command Instruction.
+
+    A single lookup in C_FIELD_WORDS, which holds every valid combination.
+    It is looked up here and not imported, so it is only built once needed.
+    """
+    try:
+        return code.C_FIELD_WORDS[instruction.dest, instruction.comp, instruction.jump]
+    except KeyError:
+        # Let the mnemonic tables say which part is wrong.
+        for part, mnemonic in (("comp", instruction.comp), ("dest", instruction.dest), ("jump", instruction.jump)):
+            try:
+                getattr(Code, part)(mnemonic)
+            except KeyError:
+                raise InvalidCommandError(instruction.line, reason="unknown {} '{}'".format(part, mnemonic)) from None
+        raise
+
+
+def two_pass(file, parser=Parser, sym_table=None):
+    """Assemble file reading the source twice.
+
+    The first pass collects the labels, the second one encodes.
+    parser is the Parser class used to read the source. Pass an empty
+    sym_table to get the symbols back, e.g. for 'SymbolTable.write_sym()'.
+
+    :rtype: array('H')
+    """
+    if sym_table is None:
+        sym_table = SymbolTable()
+    with stats.phase("label_scan"):
+        scan_labels(file, sym_table, parser)
+    stats.count("labels", sym_table.count(LABEL))
+    with stats.phase("encode"):
+        return encode(file, sym_table, parser)
+
+
+def encode(file, sym_table, parser=Parser):
+    """Second pass: encode file with the labels already in sym_table.
+
+    Variables are added to sym_table from address 16 up.
+
+    :rtype: array('H')
+    """
+    variables = sym_table.next_variable
+    resolve = sym_table.resolve
+    words = array("H")
+    with parser(file) as p:
+        try:
+            for instruction in p.instructions():
+                # format is: ixxaccccccdddjjj.
+                kind = instruction.kind
+                if kind == "A_COMMAND":
+                    word = resolve(instruction.symbol)
+                elif kind == "C_COMMAND":
+                    word = encode_c(instruction)
+                elif kind == "L_COMMAND":
+                    continue
+                else:
+                    raise InvalidCommandError(instruction.line)
+                words.append(word)
+        except OverflowError:  # from the array, checking every word costs time
+            raise constant_error(instruction.line, instruction.symbol) from None
+    stats.count("lines_read", p.line_count)
+    stats.count("variables", sym_table.next_variable - variables)
+    return words
+
+
+def single_pass(file, parser=Parser, sym_table=None):
+    """Assemble file reading the source only once.
+
+    Instructions are encoded as they are read. An A-command whose symbol is
+    not known yet (a forward label reference or a variable) is recorded in
+    a fixup list and patched once the whole input has been read. Fixups are
+    resolved in the order they were recorded so variables still get their
+    addresses from 16 up in first-use order, like 'two_pass()' does.
+    parser is the Parser class used to read the source, see 'two_pass()'
+    for sym_table.
+
+    :rtype: array('H')
+    """
+    if sym_table is None:
+        sym_table = SymbolTable()
+    with stats.phase("encode"):
+        fixups, words = _encode_and_collect_fixups(file, parser, sym_table)
+    with stats.phase("backpatch"):
+        backpatch(words, fixups, sym_table)
+    return words
+
+
+def _encode_and_collect_fixups(file, parser, sym_table):
+    """The reading half of 'single_pass()', adds the labels to sym_table.
+
+    :returns the fixup list and the words
+    """
+    fixups = []
+    get = sym_table.get
+    words = array("H")
+    with parser(file) as p:
+        try:
+            for instruction in p.instructions():
+                kind = instruction.kind
+                if kind == "A_COMMAND":
+                    symbol = instruction.symbol
+                    word = get(symbol)
+                    if word is None:
+                        fixups.append((len(words), symbol))
+                        word = 0
+                elif kind == "C_COMMAND":
+                    word = encode_c(instruction)
+                elif kind == "L_COMMAND":
+                    sym_table.add_entry(instruction.symbol, len(words))
+                    continue
+                else:
+                    raise InvalidCommandError(instruction.line)
+                words.append(word)
+        except OverflowError:  # see 'encode()'
+            raise constant_error(instruction.line, instruction.symbol) from None
+    stats.count("lines_read", p.line_count)
+    stats.count("labels", sym_table.count(LABEL))
+    stats.count("fixups", len(fixups))
+    return fixups, words
+
+
+def backpatch(words, fixups, sym_table):
+    """Patch the (index, symbol) fixups into words.
+
+    Anything still unknown at the end of input is a variable, allocated from
+    16 up in the order of the fixups.
+    """
+    variables = sym_table.next_variable
+    resolve = sym_table.resolve
+    for index, symbol in fixups:
+        words[index] = resolve(symbol)
+    stats.count("variables", sym_table.next_variable - variables)
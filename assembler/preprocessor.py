@@ -0,0 +1,245 @@
+"""Include files and macros, expanded in front of the Parser.
+
+e.g. runtime.asm:
+%macro PUSH_D          // push D on the stack
+    @SP
+    AM=M+1
+    A=A-1
+    M=D
+%endmacro
+%macro PUSH_CONST value
+    @%value
+    D=A
+    %PUSH_D
+%endmacro
+
+and Main.asm:
+%include "runtime.asm"
+%PUSH_CONST 7
+
+'%include "file"' inserts a file, relative to the including one.
+'%macro NAME param ...' up to '%endmacro' defines a macro, '%NAME arg ...'
+expands it, arguments separated by spaces or commas. In the body '%param'
+is replaced by its argument and '%%label' by a label unique to the
+expansion, for labels inside macros.
+
+Every file is read, cleaned and split into directives once per process
+and cached by path and modification time, so a runtime included by many
+sources, or read by both passes of 'two_pass()', is only parsed once. The
+expansion itself is a generator, the expanded source is never held in
+memory as a whole:
+
+words = two_pass("Main.asm", PreprocessingParser)
+
+Errors name the file and line each command comes from, for a command of
+a macro the line of the outermost call.
+"""
+import os
+import re
+import threading
+from collections import namedtuple
+
+from assembler.parser import Instruction, Parser
+from assembler.utils import ManualCache
+
+# Kinds of the items a file is parsed into.
+LINE = "line"  # (LINE, cleaned command, line number)
+INCLUDE = "include"  # (INCLUDE, absolute path, line number)
+MACRO = "macro"  # (MACRO, name, params, body items, line number)
+CALL = "call"  # (CALL, name, args, line number)
+
+MAX_DEPTH = 64  # of macros expanding macros
+PARAMETER = re.compile(r"%(%?)([\w.$:]+)")
+
+# (path, mtime) -> items of the file, shared by all threads
+_modules = ManualCache(max_size=256)
+_modules_lock = threading.Lock()
+
+
+class PreprocessorError(Exception):
+    """A bad directive, include or macro call."""
+
+
+class Origin(namedtuple("Origin", ["path", "line"])):
+    """Where an expanded command comes from, the Instruction.line of a
+    PreprocessingParser.
+
+    Formats as "5 of /path/Main.asm", so errors read "on line 5 of ...".
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "{} of {}".format(self.line, self.path)
+
+
+def parse_module(path):
+    """Returns the items of file path, see the kinds above.
+
+    :rtype: tuple
+    """
+    items = []
+    macro = None  # [name, params, body, line] while inside %macro
+    directory = os.path.dirname(path)
+    with open(path) as f:
+        for number, raw in enumerate(f, 1):
+            text = raw.split("//")[0].strip()
+            if not text:
+                continue
+            where = "{}:{}".format(path, number)
+            if not text.startswith("%"):
+                item = (LINE, "".join(text.split()), number)
+            else:
+                words = [word for word in re.split(r"[\s,]+", text[1:]) if word]
+                name = words[0] if words else ""
+                if name == "include":
+                    include = text[len("%include"):].strip().strip('"')
+                    if macro is not None or not include:
+                        raise PreprocessorError("{}: bad %include.".format(where))
+                    item = (INCLUDE, os.path.abspath(os.path.join(directory, include)), number)
+                elif name == "macro":
+                    if macro is not None or len(words) < 2:
+                        raise PreprocessorError("{}: bad %macro.".format(where))
+                    macro = [words[1], tuple(words[2:]), [], number]
+                    continue
+                elif name == "endmacro":
+                    if macro is None:
+                        raise PreprocessorError("{}: %endmacro without %macro.".format(where))
+                    item = (MACRO, macro[0], macro[1], tuple(macro[2]), macro[3])
+                    macro = None
+                elif name:
+                    item = (CALL, name, tuple(words[1:]), number)
+                else:
+                    raise PreprocessorError("{}: '%' without a directive.".format(where))
+            if macro is not None:
+                macro[2].append(item)
+            else:
+                items.append(item)
+    if macro is not None:
+        raise PreprocessorError("{}:{}: %macro {} has no %endmacro.".format(path, macro[3], macro[0]))
+    return tuple(items)
+
+
+def load(path):
+    """Returns the items of file path, parsed once per modification."""
+    key = path, os.stat(path).st_mtime_ns
+    with _modules_lock:
+        try:
+            return _modules[key]
+        except KeyError:
+            pass
+    items = parse_module(path)  # outside the lock, the worst case is parsing twice
+    with _modules_lock:
+        _modules[key] = items
+    return items
+
+
+class Preprocessor:
+    """Expands one source, macros are defined from where they are on."""
+
+    def __init__(self):
+        self.macros = {}  # name -> (MACRO item, path of the file defining it)
+        self.expansions = 0  # for unique labels
+
+    def expand(self, file):
+        """Yields the cleaned commands of file, with everything expanded."""
+        return (command for command, _ in self.located(file))
+
+    def located(self, file):
+        """Yields (command, Origin) for the commands of 'expand()'."""
+        return self._module(os.path.abspath(file), ())
+
+    def _module(self, path, includes):
+        if path in includes:
+            raise PreprocessorError("{} includes itself.".format(path))
+        yield from self._items(load(path), path, includes + (path,), 0)
+
+    def _items(self, items, path, includes, depth):
+        for item in items:
+            kind = item[0]
+            if kind == LINE:
+                yield item[1], Origin(path, item[2])
+            elif kind == INCLUDE:
+                try:
+                    yield from self._module(item[1], includes)
+                except FileNotFoundError:
+                    raise PreprocessorError("{}:{}: can't include {}.".format(path, item[2], item[1])) from None
+            elif kind == MACRO:
+                self.macros[item[1]] = item, path
+            else:
+                yield from self._call(item, path, includes, depth)
+
+    def _call(self, call, path, includes, depth, origin=None):
+        _, name, args, number = call
+        where = "{}:{}".format(path, number)
+        if origin is None:  # not called from a macro
+            origin = Origin(path, number)
+        if name not in self.macros:
+            raise PreprocessorError("{}: unknown macro %{}.".format(where, name))
+        (_, _, params, body, _), macro_path = self.macros[name]
+        if len(args) != len(params):
+            raise PreprocessorError("{}: %{} takes {} arguments, not {}.".format(
+                where, name, len(params), len(args)))
+        if depth >= MAX_DEPTH:
+            raise PreprocessorError("{}: macros nested too deep, is %{} recursive?".format(where, name))
+        self.expansions += 1
+        values = dict(zip(params, args))
+        suffix = "${}".format(self.expansions)
+
+        def substitute(match):
+            if match.group(1):
+                return match.group(2) + suffix
+            if match.group(2) not in values:
+                raise PreprocessorError("{}: %{} has no parameter %{}.".format(where, name, match.group(2)))
+            return values[match.group(2)]
+
+        for kind, *rest in body:
+            if kind == LINE:
+                yield PARAMETER.sub(substitute, rest[0]), origin
+            else:
+                inner_name, inner_args, inner_number = rest
+                inner_args = tuple(PARAMETER.sub(substitute, arg) for arg in inner_args)
+                yield from self._call((CALL, inner_name, inner_args, inner_number), macro_path, includes, depth + 1,
+                                      origin)
+
+
+class PreprocessingParser(Parser):
+    """A Parser reading file with its includes and macros expanded.
+
+    Instruction.line is the Origin of the command, a file and a line in it.
+    line_count counts the expanded commands.
+    """
+
+    def __enter__(self):
+        self.fd = Preprocessor().located(self.file)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.fd.close()
+
+    def lines(self):
+        """Returns the expanded commands, without their origins."""
+        return (command for command, _ in self.fd)
+
+    def commands(self):
+        commands = list(self.lines())
+        self.line_count += len(commands)
+        return commands
+
+    def instructions(self):
+        """Yields every expanded command as an Instruction, see
+        'Parser.instructions()', with its Origin as line.
+        """
+        new = tuple.__new__
+        cache = self.fields_cache
+        tokenize = self.tokenize
+        count = 0
+        try:
+            for command, origin in self.fd:
+                count += 1
+                try:
+                    fields = cache[command]
+                except KeyError:
+                    fields = cache[command] = tokenize(command)
+                yield new(Instruction, fields + (origin,))
+        finally:
+            self.line_count += count
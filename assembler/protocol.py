@@ -0,0 +1,78 @@
+"""The wire format between the assembler daemon and its clients.
+
+Every message, both ways, is one frame:
+
+>II     header size, body size (big endian uint32)
+header  a JSON object, utf-8
+body    raw bytes, e.g. source text or assembled output
+
+A request header looks like
+{"op": "assemble", "path": "/abs/Prog.asm", "format": "hack", "engine": "two-pass"}
+without "path" the body is the source. The response header is
+{"ok": true, "suffix": ".hack", "words": 42} with the output as body, or
+{"ok": false, "error": {"type": "KeyError", "message": "'Y'"}}.
+
+Kept free of any assembler imports so a client starts fast.
+"""
+import json
+import os
+import struct
+import tempfile
+
+FRAME = struct.Struct(">II")
+
+
+def default_socket_path():
+    """Returns the per user socket path, in $XDG_RUNTIME_DIR when set."""
+    directory = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(directory, "hack-assembler-{}.sock".format(os.getuid()))
+
+
+def pack(header, body=b""):
+    """Returns header and body as one frame."""
+    data = json.dumps(header).encode("utf-8")
+    return FRAME.pack(len(data), len(body)) + data + body
+
+
+def unpack_sizes(prefix):
+    """Returns (header size, body size) of a frame's first FRAME.size bytes."""
+    return FRAME.unpack(prefix)
+
+
+def unpack_header(data):
+    return json.loads(data.decode("utf-8"))
+
+
+def recv_exactly(sock, size):
+    """Read size bytes from a blocking socket.
+
+    :raises ConnectionError: when the peer closes first
+    """
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("Connection closed in the middle of a frame.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv(sock):
+    """Read one frame from a blocking socket.
+
+    :returns (header, body)
+    """
+    header_size, body_size = unpack_sizes(recv_exactly(sock, FRAME.size))
+    header = unpack_header(recv_exactly(sock, header_size))
+    return header, recv_exactly(sock, body_size)
+
+
+async def read(reader):
+    """Read one frame from an asyncio StreamReader.
+
+    :returns (header, body)
+    """
+    header_size, body_size = unpack_sizes(await reader.readexactly(FRAME.size))
+    header = unpack_header(await reader.readexactly(header_size))
+    return header, await reader.readexactly(body_size)
@@ -0,0 +1,68 @@
+"""Assemble requests of the daemon protocol, see assembler.protocol.
+
+Used by the daemon, and by the client itself when no daemon is running.
+"""
+import importlib
+
+from assembler.parser import MmapParser, Parser, SourceParser
+from assembler.writers import WRITERS
+
+# Engine name -> (module, function), the module is imported when the engine
+# is first used, see 'engine()'.
+ENGINES = {
+    "two-pass": ("assembler.passes", "two_pass"),
+    "single-pass": ("assembler.passes", "single_pass"),
+    "numpy": ("assembler.vectorized", "assemble"),
+    "parallel": ("assembler.parallel", "assemble"),
+    "peephole": ("assembler.optimizer", "assemble"),
+}
+
+# Engines that can hand back their symbol table, e.g. for --sym.
+SYM_ENGINES = ["two-pass", "single-pass", "peephole"]
+
+
+def engine(name):
+    """Returns the assemble function of the engine name, a key of ENGINES."""
+    module, function = ENGINES[name]
+    return getattr(importlib.import_module(module), function)
+
+
+def assemble(request, body=b""):
+    """Returns the words of the source a request names or carries in body.
+
+    :rtype: array('H')
+    """
+    name = request.get("engine", "two-pass")
+    if name not in ENGINES:
+        raise ValueError("Unknown engine {!r}.".format(name))
+    if "path" in request:
+        parser = MmapParser if request.get("mmap") else Parser
+        if request.get("preprocess"):
+            from assembler.preprocessor import PreprocessingParser
+            parser = PreprocessingParser
+        return engine(name)(request["path"], parser)
+    return engine(name)(body.decode("utf-8"), SourceParser)
+
+
+def handle(request, body=b""):
+    """Serve one assemble request.
+
+    Errors in the request or the source come back in the response instead
+    of being raised.
+
+    :returns (response header, response body)
+    """
+    try:
+        format = request.get("format", "hack")
+        if format not in WRITERS:
+            raise ValueError("Unknown format {!r}.".format(format))
+        writer = WRITERS[format]
+        words = assemble(request, body)
+        return {"ok": True, "suffix": writer.suffix, "words": len(words)}, writer.dumps(words)
+    except Exception as ex:
+        return error(ex), b""
+
+
+def error(ex):
+    """Returns the response header reporting exception ex."""
+    return {"ok": False, "error": {"type": type(ex).__name__, "message": str(ex)}}
@@ -0,0 +1,127 @@
+"""Run statistics: phase timings and hot path counters.
+
+Collection is off unless 'enable()' was called. The hooks in the passes
+only run once per file or phase, or on paths that already raised an
+exception, so a disabled run pays next to nothing:
+
+with stats.phase("encode"):
+    ...
+stats.count("variables", n)
+
+The current Stats live in a context variable, so every thread collects its
+own.
+"""
+import contextlib
+import contextvars
+import time
+from collections import Counter
+
+from assembler.parser import Parser
+
+_current = contextvars.ContextVar("stats", default=None)
+_no_phase = contextlib.nullcontext()
+
+
+class Stats:
+    """Counters and wall time per phase of one run."""
+
+    def __init__(self):
+        self.phases = Counter()
+        self.counters = Counter()
+        self.caches = {}
+        self.started = time.perf_counter()
+        self.wall_time = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def stop(self):
+        """Freeze the wall time and add this process' Parser cache statistics."""
+        self.wall_time = time.perf_counter() - self.started
+        caches = {name: cache.as_dict() for name, cache in Parser.caches().items()}
+        self.merge({"phases": {}, "counters": {}, "caches": caches})
+
+    def merge(self, other):
+        """Add the as_dict() of another run (e.g. a worker process) to this one."""
+        self.phases.update(other["phases"])
+        self.counters.update(other["counters"])
+        for name, info in other["caches"].items():
+            mine = self.caches.setdefault(name, dict(info, hits=0, misses=0))
+            mine["hits"] += info["hits"]
+            mine["misses"] += info["misses"]
+            lookups = mine["hits"] + mine["misses"]
+            mine["hit_ratio"] = mine["hits"] / lookups if lookups else 0.0
+
+    def as_dict(self):
+        return {
+            "wall_time": self.wall_time,
+            "phases": dict(self.phases),
+            "counters": dict(self.counters),
+            "caches": self.caches,
+        }
+
+    def to_json(self):
+        import json
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+    def report(self):
+        """Returns the statistics as human readable text."""
+        lines = ["Wall time: {:.3f}s".format(self.wall_time or 0.0)]
+        for name, seconds in self.phases.items():
+            lines.append("  {:<14}{:.3f}s".format(name, seconds))
+        c = self.counters
+        lines.append("Lines read: {}, commands emitted: {}".format(c["lines_read"], c["commands"]))
+        lines.append("Symbols: {} labels, {} variables".format(c["labels"], c["variables"]))
+        removed = sum(c["optimizer_" + name] for name in ("redundant_loads", "dead_loads", "jumps_to_next",
+                                                          "dead_code"))
+        if removed or c["optimizer_aliased_labels"]:
+            lines.append("Optimizer removed {} instructions: {} redundant loads, {} dead loads, {} jumps to the "
+                         "next instruction, {} unreachable; {} labels aliased".format(
+                             removed, c["optimizer_redundant_loads"], c["optimizer_dead_loads"],
+                             c["optimizer_jumps_to_next"], c["optimizer_dead_code"],
+                             c["optimizer_aliased_labels"]))
+        if c["fixups"]:
+            lines.append("Forward references backpatched: {}".format(c["fixups"]))
+        for name, info in self.caches.items():
+            lines.append("{}: {} hits, {} misses ({:.1%}), {} of {} entries".format(
+                name, info["hits"], info["misses"], info["hit_ratio"], info["currsize"], info["maxsize"]))
+        return "\n".join(lines)
+
+
+def enable():
+    """Start collecting in the current context, resetting the Parser cache stats.
+
+    :returns the new Stats
+    """
+    for cache in Parser.caches().values():
+        cache.reset_info()
+    stats = Stats()
+    _current.set(stats)
+    return stats
+
+
+def disable():
+    _current.set(None)
+
+
+def current():
+    """Returns the Stats being collected, or None."""
+    return _current.get()
+
+
+def phase(name):
+    """A context manager timing the named phase, when enabled."""
+    stats = _current.get()
+    return _no_phase if stats is None else stats.phase(name)
+
+
+def count(name, n=1):
+    """Add n to the named counter, when enabled."""
+    stats = _current.get()
+    if stats is not None:
+        stats.counters[name] += n
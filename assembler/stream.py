@@ -0,0 +1,141 @@
+"""Streaming assembly, e.g. from stdin to stdout inside a shell pipeline.
+
+Everything is a generator so memory stays bounded however long the input
+is. The catch is forward references: an A-command naming a symbol that
+isn't known yet can be a label defined further down or a variable, and
+nothing after it can be emitted until that is settled.
+
+Strategy: instructions wait in a FIFO buffer of at most 'buffer_size'
+words. Resolved words leave from the front as soon as nothing unresolved
+is ahead of them. When the buffer is full, the symbol at the front is
+taken to be a variable and gets the next free address from 16. Because the
+front is always the oldest pending use, variables are still allocated in
+first-use order, exactly as 'two_pass()' does. At end of input everything
+still pending is a variable as well.
+
+The only way this can go wrong is a label defined more than 'buffer_size'
+instructions after its first use: by then the symbol was already made a
+variable, and a StreamBufferError is raised asking for a bigger buffer.
+"""
+from collections import deque
+
+from assembler import stats
+from assembler.parser import InvalidCommandError, Parser
+from assembler.passes import constant_error, encode_c
+from assembler.symbol_table import LABEL, VARIABLE, SymbolTable
+
+
+class StreamBufferError(Exception):
+    """A forward label reference didn't resolve within the stream buffer."""
+
+
+def clean(lines):
+    """Yields the non empty cleaned commands of lines, using Parser.clean()."""
+    p = Parser(None)
+    count = 0
+    for line in lines:
+        count += 1
+        p.command = line
+        p.clean()
+        if p.command:
+            yield p.command
+    stats.count("lines_read", count)
+
+
+def encode(commands, buffer_size=4096):
+    """Yields the 16 bit words of cleaned commands, in order.
+
+    See the module docstring for how forward references are buffered.
+    """
+    p = Parser(None)
+    sym_table = SymbolTable()
+    variables = set()
+    pending = deque()  # [word, symbol] pairs, word is None until resolved
+    waiting = {}  # symbol -> its pairs still in pending
+    address = 0
+    for command in commands:
+        p.command = command
+        kind, symbol = p.fields()[:2]
+        if kind == "A_COMMAND":
+            entry = [sym_table.get(symbol), None]
+            if entry[0] is None:
+                entry[1] = symbol
+                waiting.setdefault(symbol, []).append(entry)
+            elif entry[0] > 0xFFFF:
+                raise constant_error(None, symbol)
+        elif kind == "C_COMMAND":
+            entry = [encode_c(p.instruction()), None]
+        elif kind == "L_COMMAND":
+            label = symbol
+            if label in variables:
+                raise StreamBufferError(
+                    "Label '{}' is defined more than {} instructions after its first use, "
+                    "which was already assembled as a variable. Use a bigger stream buffer."
+                    .format(label, buffer_size))
+            sym_table.add_entry(label, address)
+            for entry in waiting.pop(label, ()):
+                entry[0] = address
+            continue
+        else:
+            raise InvalidCommandError(command=command)
+        pending.append(entry)
+        address += 1
+
+        while pending and pending[0][0] is not None:
+            yield pending.popleft()[0]
+        if len(pending) > buffer_size:
+            # Out of room, the oldest unresolved symbol becomes a variable.
+            symbol = pending[0][1]
+            var_address = sym_table.add_variable(symbol)
+            variables.add(symbol)
+            for entry in waiting.pop(symbol):
+                entry[0] = var_address
+            while pending and pending[0][0] is not None:
+                yield pending.popleft()[0]
+
+    # End of input, anything still unknown is a variable.
+    while pending:
+        word, symbol = pending.popleft()
+        if word is None:
+            word = sym_table.resolve(symbol)
+        yield word
+    stats.count("labels", sym_table.count(LABEL))
+    stats.count("variables", sym_table.count(VARIABLE))
+    stats.count("commands", address)
+
+
+def blocks(words, block_size=1024):
+    """Groups words into lists of at most block_size, for bulk writes."""
+    block = []
+    for word in words:
+        block.append(word)
+        if len(block) == block_size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def assemble(in_f, out_f, writer, buffer_size=4096, block_size=1024):
+    """Assemble the text file in_f into the binary file out_f as a stream.
+
+    writer is one of the WRITERS; output is flushed every block_size words.
+    """
+    with stats.phase("stream"):
+        writer.stream(out_f, blocks(encode(clean(in_f), buffer_size), block_size))
+
+
+if __name__ == "__main__":
+    from assembler.parser import SourceParser
+    from assembler.passes import two_pass
+
+    def stream_words(source, buffer_size=4096):
+        return list(encode(clean(source.splitlines(True)), buffer_size))
+
+    # A variable pushed out of a full buffer doesn't move the labels after it.
+    source = "@x\nM=1\n" + "D=A\n" * 5000 + "(LOOP)\n@LOOP\n0;JMP\n"
+    words = stream_words(source)
+    assert words == list(two_pass(source, SourceParser)), "stream and two_pass differ"
+    assert words[-2] == 5002, words[-2]
+    source = "@x\nM=1\nD=A\nD=A\n@y\nD=A\nD=A\n(L)\n@L\n0;JMP\n@y\n"
+    assert stream_words(source, buffer_size=2) == list(two_pass(source, SourceParser))
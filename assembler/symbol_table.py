@@ -1,13 +1,49 @@
+import sys
+
+from assembler.code import BUILTIN_WORDS
+
+# Kinds of symbols, as written to .sym files.
+BUILTIN = "builtin"
+LABEL = "label"
+VARIABLE = "variable"
+
+
 class SymbolTable:
-    """Keeps a correspondence between symbolic labels an numeric addresses."""
+    """Keeps a correspondence between symbolic labels an numeric addresses.
+
+    Starts out with the builtin symbols. Constants are remembered like
+    symbols once seen, so resolving an A-command is a single dict lookup
+    whatever its symbol is. Symbols that are neither get the next variable
+    address from 16 up.
+    """
 
     def __init__(self):
-        """Create a new empty symbol table."""
-        self.table = {}
+        """Create a new symbol table holding the builtin symbols."""
+        self.table = dict(BUILTIN_WORDS)  # symbol or constant -> address
+        self.kinds = {}  # label or variable -> its kind, in definition order
+        self.next_variable = 16
+
+    def add_entry(self, symbol, address, kind=LABEL):
+        """Adds the pair (symbol, address) to the table.
 
-    def add_entry(self, symbol, address):
-        """Adds the pair (symbol, address) to the table."""
+        Builtin symbols can't be redefined, a label with the name of one is
+        ignored as the builtin always won.
+        """
+        if symbol in BUILTIN_WORDS:
+            return
+        symbol = sys.intern(symbol)
         self.table[symbol] = address
+        self.kinds[symbol] = kind
+
+    def add_variable(self, symbol):
+        """Adds symbol as the next variable.
+
+        :returns its address
+        """
+        address = self.next_variable
+        self.add_entry(symbol, address, VARIABLE)
+        self.next_variable += 1
+        return address
 
     def contains(self, symbol):
         """Does the symbol table contain the given symbol?
@@ -23,3 +59,52 @@ class SymbolTable:
         """
 
         return self.table[symbol]
+
+    def get(self, symbol):
+        """Return the address of symbol, the value if it's a constant.
+
+        :returns None for a symbol that isn't known (yet)
+        """
+        address = self.table.get(symbol)
+        if address is None and symbol.isdecimal():
+            address = self.table[symbol] = int(symbol)
+        return address
+
+    def resolve(self, symbol):
+        """Return the address of symbol, allocating a variable if it's new.
+
+        :rtype: int
+        """
+        address = self.table.get(symbol)
+        if address is None:
+            if symbol.isdecimal():
+                address = self.table[symbol] = int(symbol)
+            else:
+                address = self.add_variable(symbol)
+        return address
+
+    def count(self, kind):
+        """Returns the number of labels or variables.
+
+        :rtype: int
+        """
+        if kind == VARIABLE:
+            return self.next_variable - 16
+        return sum(1 for k in self.kinds.values() if k == kind)
+
+    def symbols(self):
+        """Yields (name, address, kind) of the builtins, then of the labels
+        and variables in the order they were defined."""
+        for symbol, address in BUILTIN_WORDS.items():
+            yield symbol, address, BUILTIN
+        for symbol, kind in self.kinds.items():
+            yield symbol, self.table[symbol], kind
+
+    def write_sym(self, file):
+        """Write the symbols to file as lines of "name address kind".
+
+        Meant for debuggers and emulators to show names instead of addresses.
+        """
+        with open(file, "w") as f:
+            for symbol, address, kind in self.symbols():
+                f.write("{} {} {}\n".format(symbol, address, kind))
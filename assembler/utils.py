@@ -1,29 +1,79 @@
 import re
+from collections import Counter, OrderedDict, namedtuple
+
+
+class LazyPattern:
+    """A class attribute holding a regex that is compiled on first use.
+
+    Until then its pattern string is available as 'pattern', like on a
+    compiled regex, so patterns can still be built from one another.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        regex = re.compile(self.pattern)
+        setattr(owner, self.name, regex)  # replaces this descriptor
+        return regex
 
 
 class Utils:
     """Helpful utilities for Assembler.
 
-    These might be used in multiple modules.
+    These might be used in multiple modules. The regexes are compiled when
+    first used, so a run only pays for the ones it needs.
     """
-    comment = re.compile(r"\\")
-    whitespace = re.compile("\s+")
-    symbol = re.compile("[a-zA-Z_.$:][\w\d_.$:]*")
-    constant = re.compile("[\d]*")
-    bad_constant = re.compile("-|0[bBxX]+")
-    a_command = re.compile("@({}|{})".format(symbol.pattern, constant.pattern))
-    dest = re.compile("\w+")  # could be more specific
-    comp = re.compile("[!\w+\-&|]+")  # could be more specific
-    jump = re.compile("\w+")  # could be more specific
-    c_command = re.compile("{c}|{c};{j}|{d}={c}|{d}={c};{j}".format(d=dest.pattern, c=comp.pattern, j=jump.pattern))
-    c_command_separators = re.compile("[;=]")
-    l_command = re.compile("\({}\)".format(symbol.pattern))
+    comment = LazyPattern(r"\\")
+    whitespace = LazyPattern("\s+")
+    symbol = LazyPattern("[a-zA-Z_.$:][\w\d_.$:]*")
+    constant = LazyPattern("[\d]*")
+    bad_constant = LazyPattern("-|0[bBxX]+")
+    a_command = LazyPattern("@({}|{})".format(symbol.pattern, constant.pattern))
+    dest = LazyPattern("\w+")  # could be more specific
+    comp = LazyPattern("[!\w+\-&|]+")  # could be more specific
+    jump = LazyPattern("\w+")  # could be more specific
+    c_command = LazyPattern("{c}|{c};{j}|{d}={c}|{d}={c};{j}".format(d=dest.pattern, c=comp.pattern, j=jump.pattern))
+    c_command_separators = LazyPattern("[;=]")
+    l_command = LazyPattern("\({}\)".format(symbol.pattern))
+    # All three commands at once, the first character picks the branch.
+    # Named groups hold the fields: a or l is the symbol, else dest, comp, jump.
+    command = LazyPattern(r"@(?P<a>{s}|{n})|\((?P<l>{s})\)|(?:(?P<dest>{d})=)?(?P<comp>{c})(?:;(?P<jump>{j}))?".format(
+        s=symbol.pattern, n=constant.pattern, d=dest.pattern, c=comp.pattern, j=jump.pattern))
+    # A raw source line: optional command, comment and whitespace around the
+    # command, '=' and ';'. Doesn't match other whitespace inside a command,
+    # e.g. "D = D + A", such lines have to be cleaned first.
+    line = LazyPattern(r"\s*(?:@(?P<a>{s}|{n})|\((?P<l>{s})\)|(?:(?P<dest>{d})\s*=\s*)?(?P<comp>{c})"
+                       r"(?:\s*;\s*(?P<jump>{j}))?)?\s*(?://.*)?\n?".format(
+                           s=symbol.pattern, n=constant.pattern, d=dest.pattern, c=comp.pattern, j=jump.pattern))
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
 
 
 class ManualCache:
-    def __init__(self, max_size=None):
-        self.cache = {}
-        # self.hit_table = {}
+    """A dict like cache with least recently used eviction.
+
+    Works like the lru_cache builtin but is filled by hand:
+    try:
+        value = cache[key]
+    except KeyError:
+        value = compute(key)
+        cache[key] = value
+
+    Once more than max_size keys are stored the least recently used one is
+    dropped, so memory stays flat however long the input is. max_size=None
+    means unbounded. With track_hits=True the hits of every key are counted
+    in 'hit_table'.
+    """
+
+    def __init__(self, max_size=None, track_hits=False):
+        self.cache = OrderedDict()
+        self.hit_table = Counter() if track_hits else None
         self.hits = 0
         self.misses = 0
         self.maxsize = max_size
@@ -35,36 +85,77 @@ class ManualCache:
     def __getitem__(self, item):
         try:
             value = self.cache[item]
-            # self.hit_table[item] += 1
-            self.hits += 1
-            return value
         except KeyError:
             self.misses += 1
             raise
+        self.cache.move_to_end(item)
+        if self.hit_table is not None:
+            self.hit_table[item] += 1
+        self.hits += 1
+        return value
 
     def __setitem__(self, key, value):
-        if self.maxsize is None or self.currsize <= self.maxsize:
-            self.cache[key] = value
-            # self.hit_table[key] = 0
-        # If over maxsize just stop storing stuff.
-
-        # else:  # delete a random 0 hit key
-            # for k, v in self.cache.items():
-            #     if v == 0:
-            #         del self.cache[key]
-            #         break
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        if self.maxsize is not None and len(self.cache) > self.maxsize:
+            # Inlined 'evict()', one key out for the one that came in.
+            old_key, _ = self.cache.popitem(last=False)
+            if self.hit_table is not None:
+                self.hit_table.pop(old_key, None)
+
+    def __contains__(self, item):
+        return item in self.cache
+
+    def evict(self):
+        """Drop least recently used keys until the cache fits in maxsize."""
+        while len(self.cache) > self.maxsize:
+            key, _ = self.cache.popitem(last=False)
+            if self.hit_table is not None:
+                self.hit_table.pop(key, None)
+
+    def resize(self, max_size):
+        """Change maxsize, evicting right away if the cache is too big."""
+        self.maxsize = max_size
+        if max_size is not None:
+            self.evict()
+
+    def cache_clear(self):
+        """Empty the cache and reset the statistics."""
+        self.cache.clear()
+        self.reset_info()
+
+    def reset_info(self):
+        """Reset the statistics but keep the cached values."""
+        self.hits = 0
+        self.misses = 0
+        if self.hit_table is not None:
+            self.hit_table.clear()
+
     def __repr__(self):
-        return repr(self.cache) + "\n" + str(self)
+        return repr(dict(self.cache)) + "\n" + str(self)
 
     def __str__(self):
-        return self.cache_info()
+        return str(self.cache_info())
 
     def cache_info(self):
-        """Should print out data like lru_cache builtin.
+        """Returns data like the lru_cache builtin.
 
         e.g. CacheInfo(hits=3, misses=8, maxsize=32, currsize=8)
         """
-        return "CacheInfo(hits={}, misses={}, maxsize={}, currsize={})".format(self.hits, self.misses, self.maxsize, self.currsize)
+        return CacheInfo(self.hits, self.misses, self.maxsize, self.currsize)
+
+    def as_dict(self, top=10):
+        """Export the statistics as a dict (e.g. for json.dump).
+
+        Includes the hit ratio and, when hits are tracked, the 'top' most hit
+        keys.
+        """
+        info = self.cache_info()._asdict()
+        lookups = self.hits + self.misses
+        info["hit_ratio"] = self.hits / lookups if lookups else 0.0
+        if self.hit_table is not None:
+            info["most_hit"] = [[repr(key), count] for key, count in self.hit_table.most_common(top)]
+        return info
 
 
 if __name__ == "__main__":
@@ -97,3 +188,15 @@ if __name__ == "__main__":
     assert Utils.l_command.fullmatch("(TEST") is None
 
     assert Utils.c_command_separators.split("a=d;jmp") == ['a', 'd', 'jmp']
+
+    # The combined tokenizer accepts exactly what the three patterns above do.
+    for command in ["@Help", "@125", "@1Help", "@-124", "A=M", "A=D;JMP", "A=D|M;JMP", "A;JMP", "D;JMP",
+                    "A", "!A", "D=D+A", "M|D|A", "A;", "=A", "=A;", "(TEST)", "(A)", "(A32)", "(25Hel)",
+                    "(TEST"]:
+        expected = any(pattern.fullmatch(command) for pattern in (Utils.a_command, Utils.c_command, Utils.l_command))
+        assert (Utils.command.fullmatch(command) is not None) == expected, command
+    assert Utils.command.fullmatch("A=D|M;JMP").group("dest", "comp", "jump") == ("A", "D|M", "JMP")
+    assert Utils.line.fullmatch("  @i  // comment\n").group("a") == "i"
+    assert Utils.line.fullmatch("// comment only\n").group("a", "l", "comp") == (None, None, None)
+    assert Utils.line.fullmatch("\tAM = M-1 ; JLE\r\n").group("dest", "comp", "jump") == ("AM", "M-1", "JLE")
+    assert Utils.line.fullmatch("D = D + A\n") is None
@@ -0,0 +1,135 @@
+"""Whole file encoding with NumPy.
+
+Needs numpy, which is optional: importing this module works without it but
+'assemble()' raises ImportError. numpy is only imported by the first
+'assemble()', as importing it takes longer than assembling most files.
+"""
+from array import array
+
+from assembler import code, stats
+from assembler.code import BUILTIN_WORDS
+from assembler.parser import InvalidCommandError, Parser
+from assembler.passes import constant_error, encode_c, two_pass
+from assembler.utils import Utils
+
+np = None  # numpy, once imported by '_import_numpy()'
+
+
+def _import_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("The vectorized engine needs numpy.") from None
+        np = numpy
+
+
+def _c_word(command, parser=Parser):
+    """Encode a C-command that isn't in C_WORDS, e.g. "null=D".
+
+    It is parsed with the caches of the parser class, see 'assemble()'.
+    """
+    p = parser(None)
+    p.command = command
+    instruction = p.instruction()
+    if instruction.kind != "C_COMMAND":
+        raise InvalidCommandError(command=command)
+    return encode_c(instruction)
+
+
+def assemble(file, parser=Parser):
+    """Assemble file with vectorized operations.
+
+    The cleaned commands are loaded at once into a NumPy unicode array and
+    classified on their first character: '@' A-command, '(' label, anything
+    else a C-command. Every distinct A- and C-command is encoded once and
+    the results are spread back with the inverse index of 'np.unique()'.
+    Symbols go through a dict pass over the distinct A-commands only, with
+    variables allocated from 16 up in first-use order. The result is the
+    same as 'two_pass()'.
+
+    :rtype: array('H')
+    """
+    _import_numpy()
+    with stats.phase("read"):
+        with parser(file) as p:
+            commands = np.array(p.commands())
+        stats.count("lines_read", p.line_count)
+    with stats.phase("encode"):
+        try:
+            return _encode(commands, parser)
+        except InvalidCommandError:
+            # The commands have no line numbers, 'two_pass()' raises the
+            # error again with the line.
+            two_pass(file, parser)
+            raise
+
+
+def _encode(commands, parser=Parser):
+    """Encode the cleaned commands, a NumPy unicode array, parser is the
+    class that read them.
+    """
+    rom = array("H")
+    if not commands.size:
+        return rom
+
+    first = commands.view(np.uint32).reshape(commands.size, -1)[:, 0]
+    is_a = first == ord("@")
+    is_l = first == ord("(")
+    is_instruction = ~is_l
+    # ROM address of each command is the number of instructions before it.
+    address = np.cumsum(is_instruction) - is_instruction
+
+    sym_table = {}
+    for label, label_address in zip(commands[is_l].tolist(), address[is_l].tolist()):
+        if not Utils.l_command.fullmatch(label):
+            raise InvalidCommandError(command=label)
+        sym_table[label[1:-1]] = label_address
+
+    # A-commands, each distinct one encoded once, in first-use order.
+    a_commands, a_first, a_inverse = np.unique(commands[is_a], return_index=True, return_inverse=True)
+    a_values = np.zeros(a_commands.size, dtype=np.int64)
+    # Drop the '@' by slicing off the first code point of every command.
+    width = a_commands.itemsize // 4
+    if a_commands.size and width > 1:
+        codes = a_commands.view(np.uint32).reshape(a_commands.size, width)[:, 1:]
+        symbols = np.ascontiguousarray(codes).view("U{}".format(width - 1)).reshape(-1)
+        constant = np.char.isdigit(symbols)
+        a_values[constant] = symbols[constant].astype(np.int64)
+    else:
+        constant = np.zeros(a_commands.size, dtype=bool)
+    a_list = a_commands.tolist()
+    order = np.argsort(a_first, kind="stable")
+    next_symbol = 16
+    for i in order[~constant[order]].tolist():
+        command = a_list[i]
+        if not Utils.a_command.fullmatch(command):
+            raise InvalidCommandError(command=command)
+        symbol = command[1:]
+        if symbol in BUILTIN_WORDS:
+            a_values[i] = BUILTIN_WORDS[symbol]
+        elif symbol in sym_table:
+            a_values[i] = sym_table[symbol]
+        else:
+            sym_table[symbol] = next_symbol
+            a_values[i] = next_symbol
+            next_symbol += 1
+    stats.count("labels", len(sym_table) - (next_symbol - 16))
+    stats.count("variables", next_symbol - 16)
+    too_big = a_values[order] > 0xFFFF
+    if too_big.any():
+        raise constant_error(None, a_list[order[too_big.argmax()]][1:])  # the first in the source
+
+    # C-commands, a table lookup per distinct command.
+    is_c = is_instruction & ~is_a
+    c_commands, c_inverse = np.unique(commands[is_c], return_inverse=True)
+    c_words = code.C_WORDS
+    c_values = np.array([c_words[c] if c in c_words else _c_word(c, parser) for c in c_commands.tolist()],
+                        dtype=np.int64)
+
+    words = np.empty(int(is_instruction.sum()), dtype=np.uint16)
+    words[address[is_a]] = a_values[a_inverse.reshape(-1)]
+    words[address[is_c]] = c_values[c_inverse.reshape(-1)]
+    rom.frombytes(words.astype("=u2").tobytes())
+    return rom
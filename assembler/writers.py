@@ -0,0 +1,159 @@
+import io
+import sys
+from array import array
+
+from assembler.code import Code
+
+
+def as_rom(words, byteorder="little"):
+    """Returns words as an array('H') in the given byte order."""
+    rom = array("H", words)
+    if byteorder != sys.byteorder:
+        rom.byteswap()
+    return rom
+
+
+class TextWriter:
+    """The textual '.hack' format, one 16 character binary word per line."""
+    suffix = ".hack"
+
+    def text(self, words):
+        """Returns the whole file as a single string."""
+        lines = Code.lines(words)
+        if not lines:
+            return ""
+        lines.append("")  # trailing line ending
+        return "\n".join(lines)
+
+    def write(self, out_file, words):
+        with open(out_file, "w") as out_f:
+            out_f.write(self.text(words))
+
+    def dumps(self, words):
+        """Returns the bytes 'write()' would write."""
+        return self.text(words).encode("ascii")
+
+    def stream(self, out_f, blocks):
+        """Write blocks of words to the binary file out_f as they come."""
+        for words in blocks:
+            out_f.write(self.text(words).encode("ascii"))
+            out_f.flush()
+
+
+class GzipTextWriter(TextWriter):
+    """The textual '.hack' format, gzip compressed.
+
+    The header mtime is fixed so the same ROM always gives the same bytes.
+    """
+    suffix = ".hack.gz"
+
+    def write(self, out_file, words):
+        with open(out_file, "wb") as out_f:
+            out_f.write(self.dumps(words))
+
+    def dumps(self, words):
+        import gzip  # only for this format
+        data = io.BytesIO()
+        with gzip.GzipFile(filename="", mode="wb", fileobj=data, mtime=0) as gz:
+            gz.write(self.text(words).encode("ascii"))
+        return data.getvalue()
+
+    def stream(self, out_f, blocks):
+        import gzip
+        with gzip.GzipFile(filename="", mode="wb", fileobj=out_f, mtime=0) as gz:
+            for words in blocks:
+                gz.write(self.text(words).encode("ascii"))
+                gz.flush()
+                out_f.flush()
+
+
+class RawWriter:
+    """A raw ROM image of packed uint16 words."""
+    suffix = ".bin"
+
+    def __init__(self, byteorder="little"):
+        self.byteorder = byteorder
+
+    def write(self, out_file, words):
+        with open(out_file, "wb") as out_f:
+            as_rom(words, self.byteorder).tofile(out_f)
+
+    def dumps(self, words):
+        return as_rom(words, self.byteorder).tobytes()
+
+    def stream(self, out_f, blocks):
+        for words in blocks:
+            as_rom(words, self.byteorder).tofile(out_f)
+            out_f.flush()
+
+
+class IntelHexWriter:
+    """Intel HEX, 16 data bytes per record.
+
+    Each word takes two bytes in the given byte order. Extended linear
+    address records are emitted for images larger than 64K bytes.
+    """
+    suffix = ".hex"
+    record_size = 16
+
+    def __init__(self, byteorder="little"):
+        self.byteorder = byteorder
+
+    @staticmethod
+    def record(address, record_type, data=b""):
+        """Returns one ':LLAAAATT<data>CC' record."""
+        body = bytes((len(data), address >> 8, address & 0xFF, record_type)) + data
+        checksum = -sum(body) & 0xFF
+        return ":{}{:02X}".format(body.hex().upper(), checksum)
+
+    def records(self, data, offset=0):
+        """Returns the records of data, placed at byte offset."""
+        records = []
+        for start in range(0, len(data), self.record_size):
+            address = (offset + start) & 0xFFFF
+            if offset + start and not address:
+                records.append(self.record(0, 0x04, ((offset + start) >> 16).to_bytes(2, "big")))
+            records.append(self.record(address, 0x00, data[start:start + self.record_size]))
+        return records
+
+    def text(self, words):
+        """Returns the whole file as a single string."""
+        records = self.records(as_rom(words, self.byteorder).tobytes())
+        records.append(self.record(0, 0x01))
+        records.append("")  # trailing line ending
+        return "\n".join(records)
+
+    def write(self, out_file, words):
+        with open(out_file, "w") as out_f:
+            out_f.write(self.text(words))
+
+    def dumps(self, words):
+        return self.text(words).encode("ascii")
+
+    def stream(self, out_f, blocks):
+        offset = 0
+        rest = b""  # bytes that don't fill a whole record yet
+        for words in blocks:
+            data = rest + as_rom(words, self.byteorder).tobytes()
+            size = len(data) - len(data) % self.record_size
+            records = self.records(data[:size], offset)
+            if records:
+                records.append("")
+                out_f.write("\n".join(records).encode("ascii"))
+                out_f.flush()
+            offset += size
+            rest = data[size:]
+        records = self.records(rest, offset)
+        records.append(self.record(0, 0x01))
+        records.append("")
+        out_f.write("\n".join(records).encode("ascii"))
+        out_f.flush()
+
+
+WRITERS = {
+    "hack": TextWriter(),
+    "hack.gz": GzipTextWriter(),
+    "raw": RawWriter("little"),
+    "raw-be": RawWriter("big"),
+    "ihex": IntelHexWriter(),
+}
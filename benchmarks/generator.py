@@ -0,0 +1,93 @@
+"""Synthetic Hack assembly workloads.
+
+e.g. python -m benchmarks.generator --size 100000 > workload.asm
+"""
+import argparse
+import random
+import sys
+
+from assembler.code import BUILTIN_SYMBOLS, C_WORDS
+
+# Labels are only defined in the first 32K instructions so that every label
+# address still fits an A-command however big the workload is.
+MAX_LABEL_ADDRESS = 0x7FFF
+
+
+def generate(size, label_density=0.05, variables=50, comment_ratio=0.2,
+             c_variety=64, a_ratio=0.45, seed=0):
+    """Returns the source of a program with size instructions.
+
+    label_density: labels per instruction.
+    variables: number of distinct variables.
+    comment_ratio: share of lines with a comment, half of them comment
+        only lines, the others trailing comments. Indentation is random.
+    c_variety: number of distinct C-instructions used, 1 to len(C_WORDS).
+    a_ratio: share of A-instructions. They are split between constants,
+        builtin symbols, variables and labels.
+
+    The same arguments always give the same source.
+    """
+    r = random.Random(seed)
+    c_commands = sorted(C_WORDS)
+    r.shuffle(c_commands)
+    c_commands = c_commands[:max(1, min(c_variety, len(c_commands)))]
+    builtins = sorted(BUILTIN_SYMBOLS)
+    variable_names = ["var{}".format(i) for i in range(variables)]
+    label_count = max(1, int(size * label_density))
+    label_names = ["LABEL{}".format(i) for i in range(label_count)]
+    label_at = {}
+    for name in label_names:
+        label_at.setdefault(r.randrange(min(size, MAX_LABEL_ADDRESS) or 1), []).append(name)
+
+    lines = ["// Synthetic workload: {} instructions, seed {}".format(size, seed)]
+    for address in range(size):
+        for name in label_at.get(address, ()):
+            lines.append("({})".format(name))
+        if r.random() < a_ratio:
+            kind = r.random()
+            if kind < 0.3:
+                symbol = str(r.randrange(0x8000))
+            elif kind < 0.5:
+                symbol = r.choice(builtins)
+            elif kind < 0.8 and variable_names:
+                symbol = r.choice(variable_names)
+            else:
+                symbol = r.choice(label_names)
+            command = "@" + symbol
+        else:
+            command = r.choice(c_commands)
+            if r.random() < 0.3:  # written with spaces
+                command = command.replace("=", " = ").replace(";", " ; ")
+        line = r.choice(("", "", "    ", "\t")) + command
+        if r.random() < comment_ratio:
+            if r.random() < 0.5:
+                lines.append("// " + "comment " * r.randrange(1, 6))
+            else:
+                line += "  // trailing comment"
+        lines.append(line)
+    lines.append("")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Generate a synthetic Hack assembly workload.")
+    arg_parser.add_argument("--size", type=int, default=10000, help="instructions (default: %(default)s)")
+    arg_parser.add_argument("--label-density", type=float, default=0.05)
+    arg_parser.add_argument("--variables", type=int, default=50)
+    arg_parser.add_argument("--comment-ratio", type=float, default=0.2)
+    arg_parser.add_argument("--c-variety", type=int, default=64)
+    arg_parser.add_argument("--a-ratio", type=float, default=0.45)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("-o", "--output", help="output file (default: stdout)")
+    args = arg_parser.parse_args(argv)
+    source = generate(args.size, args.label_density, args.variables, args.comment_ratio,
+                      args.c_variety, args.a_ratio, args.seed)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(source)
+    else:
+        sys.stdout.write(source)
+
+
+if __name__ == "__main__":
+    main()
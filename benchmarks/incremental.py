@@ -0,0 +1,78 @@
+"""Time incremental edits against the file size.
+
+e.g.
+python -m benchmarks.incremental --size 10000 100000 400000
+
+Every edit is made and undone --repeat times on one IncrementalAssembler,
+the best time of an edit is printed with the number of words it changes.
+Edits in the middle of a workload come after its labels, see
+'benchmarks.generator', and stay flat. Edits at the top move every label,
+so their time follows the references to patch, i.e. the size of the diff.
+"""
+import argparse
+import sys
+import time
+
+from assembler.incremental import IncrementalAssembler
+from benchmarks.generator import generate
+
+# name -> (where, lines to insert), where as a fraction of the lines
+EDITS = {
+    "replace, middle": (0.5, None),
+    "insert, middle": (0.5, ["D=D+1\n"]),
+    "insert, top": (0.0, ["D=D+1\n"]),
+    "new variable, middle": (0.5, ["@fresh\n"]),
+    "new variable, top": (0.0, ["@fresh\n"]),
+    "set_source, middle": (0.5, ["D=D+1\n"]),
+}
+
+
+def _time(edit, undo, repeat):
+    """Returns the best time of edit in ms and the words it changed."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        diff = edit()
+        elapsed = time.perf_counter() - start
+        undo()
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, diff.changed()
+
+
+def run(size, repeat=5):
+    """Returns {edit name: (ms, words changed)} for a workload of size."""
+    source = generate(size)
+    ia = IncrementalAssembler(source)
+    lines = list(ia.lines)
+    results = {}
+    for name, (where, inserted) in EDITS.items():
+        line = 5 + int((len(lines) - 10) * where)
+        if name.startswith("set_source"):
+            edited = "".join(lines[:line] + inserted + lines[line:])
+            results[name] = _time(lambda: ia.set_source(edited), lambda: ia.set_source(source), repeat)
+        elif inserted is None:
+            results[name] = _time(lambda: ia.edit(line, line + 1, "D=D-1\n"),
+                                  lambda: ia.edit(line, line + 1, lines[line]), repeat)
+        else:
+            results[name] = _time(lambda: ia.edit(line, line, inserted),
+                                  lambda: ia.edit(line, line + len(inserted), []), repeat)
+    return results
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Time incremental edits against the file size.")
+    arg_parser.add_argument("--size", type=int, nargs="+", default=[10000, 100000, 400000],
+                            help="instructions of the workloads (default: %(default)s)")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args(argv)
+
+    print("{:<24}".format("instructions") + "".join("{:>20}".format(size) for size in args.size))
+    results = [run(size, args.repeat) for size in args.size]
+    for name in EDITS:
+        print("{:<24}".format(name) + "".join(
+            "{:>20}".format("{:.2f}ms {:>6}".format(*result[name])) for result in results))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
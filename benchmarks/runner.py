@@ -0,0 +1,214 @@
+"""Time the assembler engines phase by phase on synthetic workloads.
+
+e.g.
+python -m benchmarks.runner --size 100000 -o results.json
+python -m benchmarks.runner --size 100000 --baseline results.json
+
+Every engine runs in its own fresh process so peak RSS and the Parser
+caches belong to that engine alone. The best of --repeat runs is kept.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+from benchmarks.generator import generate
+
+
+def peak_rss():
+    """Returns the peak resident set size of this process in KiB, or None."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss  # bytes on macOS
+
+
+def _package(file, out_file, engine):
+    """Phases of the package pipeline, Parser + Code + SymbolTable."""
+    from assembler.parser import Parser
+    from assembler.passes import encode, scan_labels, single_pass
+    from assembler.symbol_table import SymbolTable
+    from assembler.writers import WRITERS
+    for cache in Parser.caches().values():
+        cache.cache_clear()
+    phases = {}
+    start = time.perf_counter()
+    if engine == "two-pass":
+        sym_table = SymbolTable()
+        scan_labels(file, sym_table)
+        phases["label_scan"] = time.perf_counter() - start
+        start = time.perf_counter()
+        words = encode(file, sym_table)
+    elif engine == "single-pass":
+        words = single_pass(file)
+    else:
+        from assembler import vectorized
+        words = vectorized.assemble(file)
+    phases["encode"] = time.perf_counter() - start
+    start = time.perf_counter()
+    WRITERS["hack"].write(out_file, words)
+    phases["write"] = time.perf_counter() - start
+    caches = {name: cache.as_dict() for name, cache in Parser.caches().items()}
+    return phases, len(words), caches
+
+
+def _legacy(file, out_file):
+    """Phases of Assembler_v1.Assembler, which runs its label scan twice."""
+    from Assembler_v1 import Assembler
+    start = time.perf_counter()
+    Assembler().preparse_file(file)
+    label_scan = time.perf_counter() - start
+    start = time.perf_counter()
+    asm = Assembler()
+    asm.convert_file(file)  # label scan, then encode + write
+    total = time.perf_counter() - start
+    os.replace(os.path.splitext(file)[0] + ".hack", out_file)
+    phases = {"label_scan": label_scan, "encode": max(0.0, total - label_scan)}
+    return phases, asm.line_count, {}
+
+
+def run_engine(engine, file, repeat):
+    """Runs in a fresh process, returns the best timing of engine on file."""
+    best = None
+    out_file = file + "." + engine + ".hack"
+    for _ in range(repeat):
+        if engine == "v1":
+            phases, instructions, caches = _legacy(file, out_file)
+        else:
+            phases, instructions, caches = _package(file, out_file, engine)
+        if best is None or sum(phases.values()) < sum(best[0].values()):
+            best = phases, instructions, caches
+    phases, instructions, caches = best
+    total = sum(phases.values())
+    return {
+        "phases": phases,
+        "total": total,
+        "instructions": instructions,
+        "instructions_per_second": instructions / total if total else None,
+        "peak_rss_kib": peak_rss(),
+        "caches": caches,
+    }
+
+
+def available_engines():
+    engines = ["two-pass", "single-pass", "v1"]
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        engines.insert(2, "numpy")
+    return engines
+
+
+def run(size, engines=None, repeat=3, **workload):
+    """Benchmark engines on a generated workload of size instructions.
+
+    workload holds extra 'generate()' arguments.
+
+    :returns a dict ready for json.dump
+    """
+    engines = engines or available_engines()
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "workload": dict(workload, size=size),
+        "engines": {},
+    }
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        file = os.path.join(tmp, "workload.asm")
+        with open(file, "w") as f:
+            f.write(generate(size, **workload))
+        outputs = {}
+        for engine in engines:
+            with ctx.Pool(1) as pool:
+                results["engines"][engine] = pool.apply(run_engine, (engine, file, repeat))
+            with open(file + "." + engine + ".hack", "rb") as f:
+                outputs[engine] = f.read()
+        results["identical_output"] = len(set(outputs.values())) <= 1
+    return results
+
+
+def compare(results, baseline, threshold=0.1):
+    """Compare results to baseline, both from 'run()'.
+
+    :returns (report lines, list of engines slower than threshold)
+    """
+    lines = []
+    regressions = []
+    if results["workload"] != baseline["workload"]:
+        lines.append("Warning: the workloads differ, the comparison is not meaningful.")
+    for engine, result in results["engines"].items():
+        base = baseline["engines"].get(engine)
+        if base is None:
+            continue
+        change = result["total"] / base["total"] - 1 if base["total"] else 0.0
+        lines.append("{:12} {:8.3f}s vs {:8.3f}s  {:+.1%}".format(engine, result["total"], base["total"], change))
+        if change > threshold:
+            regressions.append(engine)
+    return lines, regressions
+
+
+def report(results):
+    """Returns results as human readable lines."""
+    lines = ["Workload: {}".format(results["workload"])]
+    for engine, result in results["engines"].items():
+        phases = ", ".join("{} {:.3f}s".format(k, v) for k, v in result["phases"].items())
+        lines.append("{:12} {:10.0f} instructions/s  peak RSS {} KiB  ({})".format(
+            engine, result["instructions_per_second"] or 0, result["peak_rss_kib"], phases))
+        for name, info in result["caches"].items():
+            lines.append("{:12}   {}: hit ratio {:.1%}, {} entries".format(
+                "", name, info["hit_ratio"], info["currsize"]))
+    if not results["identical_output"]:
+        lines.append("WARNING: the engines did not produce identical output!")
+    return lines
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Benchmark the Hack assembler engines.")
+    arg_parser.add_argument("--size", type=int, default=100000, help="instructions (default: %(default)s)")
+    arg_parser.add_argument("--label-density", type=float, default=0.05)
+    arg_parser.add_argument("--variables", type=int, default=50)
+    arg_parser.add_argument("--comment-ratio", type=float, default=0.2)
+    arg_parser.add_argument("--c-variety", type=int, default=64)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--engine", action="append", dest="engines", choices=available_engines(),
+                            help="engine to run, can be repeated (default: all)")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    arg_parser.add_argument("--baseline", help="compare to results saved with -o")
+    arg_parser.add_argument("--threshold", type=float, default=0.1,
+                            help="fail when an engine is this much slower than the baseline "
+                                 "(default: %(default)s)")
+    args = arg_parser.parse_args(argv)
+
+    results = run(args.size, args.engines, args.repeat, label_density=args.label_density,
+                  variables=args.variables, comment_ratio=args.comment_ratio,
+                  c_variety=args.c_variety, seed=args.seed)
+    print("\n".join(report(results)))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print("Slower than the baseline: {}".format(", ".join(regressions)))
+            return 1
+    return 0 if results["identical_output"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
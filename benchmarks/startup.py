@@ -0,0 +1,111 @@
+"""Check the cold start cost of the command line interface.
+
+e.g.
+python -m benchmarks.startup
+python -m benchmarks.startup --budget 30 --module assembler.cli
+
+Imports the module in fresh interpreters under 'python -X importtime' and
+keeps the best cumulative time. Fails when that is over the budget, or
+when a module that should only be imported on demand was imported anyway,
+or a lazy table of assembler.code was built. The last two catch most
+regressions even on a machine too noisy to time.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Only imported when an option or a code path needs them.
+DEFERRED = [
+    "pdb",
+    "numpy",
+    "asyncio",
+    "concurrent.futures",
+    "cProfile",
+    "pstats",
+    "glob",
+    "gzip",
+    "json",
+    "assembler.build_cache",
+    "assembler.stream",
+    "assembler.optimizer",
+    "assembler.parallel",
+    "assembler.vectorized",
+]
+
+
+def import_times(module):
+    """Import module in a fresh interpreter.
+
+    :returns {imported module: (self us, cumulative us)}
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(own), int(cumulative)
+    return times
+
+
+def built_tables(module):
+    """Returns the lazy tables of assembler.code that importing module builds."""
+    code = ("import {}, assembler.code as c; "
+            "print(' '.join(name for name in c._LAZY_TABLES if name in vars(c)))").format(module)
+    result = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    return result.stdout.split()
+
+
+def run(module="assembler.cli", repeat=5):
+    """Returns the best of repeat imports of module, ready for json.dump."""
+    best = None
+    for _ in range(repeat):
+        times = import_times(module)
+        if best is None or times[module][1] < best[module][1]:
+            best = times
+    slowest = sorted(best.items(), key=lambda item: item[1][0], reverse=True)[:10]
+    return {
+        "module": module,
+        "import_ms": best[module][1] / 1000,
+        "modules": len(best),
+        "slowest": [{"module": name, "self_ms": own / 1000} for name, (own, _) in slowest],
+        "deferred_imported": [name for name in DEFERRED if name in best],
+        "tables_built": built_tables(module),
+    }
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Check the import time of the assembler CLI.")
+    arg_parser.add_argument("--module", default="assembler.cli", help="module to import (default: %(default)s)")
+    arg_parser.add_argument("--budget", type=float, default=50.0, metavar="MS",
+                            help="fail above this import time (default: %(default)s)")
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    args = arg_parser.parse_args(argv)
+
+    results = run(args.module, args.repeat)
+    print("{}: {:.1f}ms for {} modules (budget {:.1f}ms)".format(
+        results["module"], results["import_ms"], results["modules"], args.budget))
+    for entry in results["slowest"]:
+        print("  {:<32}{:6.2f}ms".format(entry["module"], entry["self_ms"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    status = 0
+    if results["deferred_imported"]:
+        print("Imported at startup but should be deferred: {}".format(", ".join(results["deferred_imported"])))
+        status = 1
+    if results["tables_built"]:
+        print("Tables built at startup but should be lazy: {}".format(", ".join(results["tables_built"])))
+        status = 1
+    if results["import_ms"] > args.budget:
+        print("Over the startup budget.")
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())